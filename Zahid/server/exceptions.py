@@ -3,4 +3,22 @@ class InvalidHash(Exception):
     message = "Invalid hash"
 
 class FIleNotFound(Exception):
-    message = "File not found"
\ No newline at end of file
+    message = "File not found"
+
+class LinkExpired(Exception):
+    message = "Link expired"
+
+class ServerBusy(Exception):
+    message = "All clients are busy, try again shortly"
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__(self.message)
+        self.retry_after = retry_after
+
+class RateLimited(Exception):
+    message = "Too many streams, try again later"
+
+    def __init__(self, limit: str, retry_after: int = 1):
+        super().__init__(self.message)
+        self.limit = limit
+        self.retry_after = retry_after
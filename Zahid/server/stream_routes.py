@@ -1,21 +1,48 @@
 import re
 import time
-import math
+import asyncio
 import logging
 import secrets
 import mimetypes
+import urllib.parse
+from typing import List, Optional, Tuple
 from aiohttp import web
 from aiohttp.http_exceptions import BadStatusLine
 from Zahid.bot import multi_clients, work_loads, StreamBot
-from Zahid.server.exceptions import FIleNotFound, InvalidHash
+from Zahid.server.exceptions import FIleNotFound, InvalidHash, LinkExpired, RateLimited, ServerBusy
 from Zahid import StartTime, __version__
 from ..utils.time_format import get_readable_time
-from ..utils.custom_dl import ByteStreamer
+from ..utils.custom_dl import ByteStreamer, class_cache, get_streamer, yield_file_striped
+from ..utils.chunk_cache import chunk_cache, hot_cache
+from ..utils.chunk_planner import plan_parts
+from ..utils.file_properties import FileProperties
+from ..utils.conditional import (
+    http_date,
+    if_range_matches,
+    is_not_modified,
+    make_etag,
+    make_last_modified,
+)
+from ..utils.http_range import (
+    RangeNotSatisfiable,
+    multipart_body,
+    multipart_headers,
+    multipart_length,
+    parse_range,
+)
+from ..utils.admission import Ticket, admission
+from ..utils.load_balancer import balancer
+from ..utils.rate_limit import SLICE_SIZE, Grant, client_ip, shape, stream_limits
+from ..utils.signed_link import read_token
+from ..utils.stream_writer import StreamState, log_failed_stream, stream_writer
+from ..utils.client_health import client_health
 from Zahid.utils.render_template import render_page
-from config import MULTI_CLIENT
+from config import MULTI_CLIENT, STRIPED_STREAM, STRIPE_CLIENTS, URL
 
 
 routes = web.RouteTableDef()
+# s/<token>/<file name>, the path of a signed link
+SIGNED_PATH = re.compile(r"^s/([A-Za-z0-9_-]+\.[A-Za-z0-9_-]+)(?:/\S*)?$")
 
 @routes.get("/", allow_head=True)
 async def root_route_handler(_):
@@ -31,6 +58,12 @@ async def root_route_handler(_):
                     sorted(work_loads.items(), key=lambda x: x[1], reverse=True)
                 )
             ),
+            "file_cache": [s.cached_file_ids.stats() for s in class_cache.values()],
+            "hot_cache": hot_cache.stats() if hot_cache else None,
+            "balancer": balancer.describe(),
+            "streams": stream_writer.stats(),
+            "admission": admission.stats(),
+            "limits": stream_limits.stats(),
             "version": __version__,
         }
     )
@@ -39,15 +72,44 @@ async def root_route_handler(_):
 @routes.get(r"/watch/{path:\S+}", allow_head=True)
 async def stream_handler(request: web.Request):
     try:
-        path = request.match_info["path"]
-        match = re.search(r"^([a-zA-Z0-9_-]{6})(\d+)$", path)
-        if match:
-            secure_hash = match.group(1)
-            id = int(match.group(2))
-        else:
-            id = int(re.search(r"(\d+)(?:\/\S+)?", path).group(1))
-            secure_hash = request.rel_url.query.get("hash")
-        return web.Response(text=await render_page(id, secure_hash), content_type='text/html')
+        id, secure_hash, link = parse_path(request)
+        src = urllib.parse.urljoin(URL, request.rel_url.raw_path[len("/watch/"):]) if link else None
+        return web.Response(text=await render_page(id, secure_hash, src), content_type='text/html')
+    except LinkExpired as e:
+        raise web.HTTPGone(text=e.message)
+    except InvalidHash as e:
+        raise web.HTTPForbidden(text=e.message)
+    except FIleNotFound as e:
+        raise web.HTTPNotFound(text=e.message)
+    except (AttributeError, BadStatusLine, ConnectionResetError):
+        pass
+    except Exception as e:
+        logging.critical(e.with_traceback(None))
+        raise web.HTTPInternalServerError(text=str(e))
+
+@routes.get(r"/meta/{path:\S+}")
+async def meta_handler(request: web.Request):
+    try:
+        id, secure_hash, link = parse_path(request)
+        file_properties = link or await lookup_file_properties(id, secure_hash)
+        mime_type, file_name = media_type(file_properties)
+        last_modified = make_last_modified(file_properties)
+        return web.json_response(
+            {
+                "id": id,
+                "file_name": file_name,
+                "file_size": file_properties.file_size,
+                "mime_type": mime_type,
+                "dc_id": file_properties.dc_id,
+                "etag": make_etag(file_properties),
+                "last_modified": http_date(last_modified) if last_modified else None,
+                "accept_ranges": "bytes",
+            }
+        )
+    except web.HTTPException:
+        raise
+    except LinkExpired as e:
+        raise web.HTTPGone(text=e.message)
     except InvalidHash as e:
         raise web.HTTPForbidden(text=e.message)
     except FIleNotFound as e:
@@ -61,15 +123,12 @@ async def stream_handler(request: web.Request):
 @routes.get(r"/{path:\S+}", allow_head=True)
 async def stream_handler(request: web.Request):
     try:
-        path = request.match_info["path"]
-        match = re.search(r"^([a-zA-Z0-9_-]{6})(\d+)$", path)
-        if match:
-            secure_hash = match.group(1)
-            id = int(match.group(2))
-        else:
-            id = int(re.search(r"(\d+)(?:\/\S+)?", path).group(1))
-            secure_hash = request.rel_url.query.get("hash")
-        return await media_streamer(request, id, secure_hash)
+        id, secure_hash, link = parse_path(request)
+        return await media_streamer(request, id, secure_hash, link)
+    except web.HTTPException:
+        raise
+    except LinkExpired as e:
+        raise web.HTTPGone(text=e.message)
     except InvalidHash as e:
         raise web.HTTPForbidden(text=e.message)
     except FIleNotFound as e:
@@ -80,65 +139,71 @@ async def stream_handler(request: web.Request):
         logging.critical(e.with_traceback(None))
         raise web.HTTPInternalServerError(text=str(e))
 
-class_cache = {}
-
-async def media_streamer(request: web.Request, id: int, secure_hash: str):
-    range_header = request.headers.get("Range", 0)
-    
-    index = min(work_loads, key=work_loads.get)
-    faster_client = multi_clients[index]
-    
-    if MULTI_CLIENT:
-        logging.info(f"Client {index} is now serving {request.remote}")
-
-    if faster_client in class_cache:
-        tg_connect = class_cache[faster_client]
-        logging.debug(f"Using cached ByteStreamer object for client {index}")
-    else:
-        logging.debug(f"Creating new ByteStreamer object for client {index}")
-        tg_connect = ByteStreamer(faster_client)
-        class_cache[faster_client] = tg_connect
-    logging.debug("before calling get_file_properties")
-    file_id = await tg_connect.get_file_properties(id)
-    logging.debug("after calling get_file_properties")
-    
-    if file_id.unique_id[:6] != secure_hash:
-        logging.debug(f"Invalid hash for message with ID {id}")
-        raise InvalidHash
-    
-    file_size = file_id.file_size
+def parse_path(request: web.Request) -> Tuple[int, Optional[str], Optional[FileProperties]]:
+    """
+    Returns the message ID and secure hash a path refers to. For a signed link, the
+    file properties carried by its verified token are returned too.
+    """
+    path = request.match_info["path"]
+    signed = SIGNED_PATH.match(path)
+    if signed:
+        link = read_token(signed.group(1))
+        return link.message_id, link.unique_id[:6], link
+    match = re.search(r"^([a-zA-Z0-9_-]{6})(\d+)$", path)
+    if match:
+        return int(match.group(2)), match.group(1), None
+    id = int(re.search(r"(\d+)(?:\/\S+)?", path).group(1))
+    return id, request.rel_url.query.get("hash"), None
 
-    if range_header:
-        from_bytes, until_bytes = range_header.replace("bytes=", "").split("-")
-        from_bytes = int(from_bytes)
-        until_bytes = int(until_bytes) if until_bytes else file_size - 1
-    else:
-        from_bytes = request.http_range.start or 0
-        until_bytes = (request.http_range.stop or file_size) - 1
-
-    if (until_bytes > file_size) or (from_bytes < 0) or (until_bytes < from_bytes):
-        return web.Response(
-            status=416,
-            body="416: Range not satisfiable",
-            headers={"Content-Range": f"bytes */{file_size}"},
-        )
+def known_file_properties(id: int) -> Optional[FileProperties]:
+    """
+    Returns the properties of a message's media if any client already has them cached.
+    """
+    for streamer in class_cache.values():
+        file_properties = streamer.cached_file_ids.peek(id)
+        if file_properties:
+            return file_properties
+    return None
 
-    chunk_size = 1024 * 1024
-    until_bytes = min(until_bytes, file_size - 1)
+def no_client_available(id: int) -> web.HTTPServiceUnavailable:
+    logging.warning(f"No healthy client to serve message with ID {id}")
+    return web.HTTPServiceUnavailable(
+        text="All clients are temporarily unavailable",
+        headers={"Retry-After": str(client_health.retry_after())},
+    )
 
-    offset = from_bytes - (from_bytes % chunk_size)
-    first_part_cut = from_bytes - offset
-    last_part_cut = until_bytes % chunk_size + 1
+async def lookup_file_properties(id: int, secure_hash: str) -> FileProperties:
+    """
+    Returns the properties of a message's media for requests that send no body, like HEAD
+    and /meta. Cached properties are used as they are; otherwise the best client looks the
+    message up, without a media session, a GetFile request or a change to work_loads.
+    """
+    file_properties = known_file_properties(id)
+    if file_properties is None:
+        ranked = balancer.rank()
+        if not ranked:
+            raise no_client_available(id)
+        file_properties = await get_streamer(ranked[0]).get_file_properties(id)
+    check_hash(id, file_properties, secure_hash)
+    return file_properties
 
-    req_length = until_bytes - from_bytes + 1
-    part_count = math.ceil(until_bytes / chunk_size) - math.floor(offset / chunk_size)
-    body = tg_connect.yield_file(
-        file_id, index, offset, first_part_cut, last_part_cut, part_count, chunk_size
-    )
+def check_hash(id: int, file_properties: FileProperties, secure_hash: str, link: Optional[FileProperties] = None) -> None:
+    """
+    Raises InvalidHash unless the resolved media matches the link. A signed link must
+    match the full unique ID and size its token carries, not only the hash prefix.
+    """
+    if file_properties.unique_id[:6] != secure_hash or (
+        link and (link.unique_id, link.file_size) != (file_properties.unique_id, file_properties.file_size)
+    ):
+        logging.debug(f"Invalid hash for message with ID {id}")
+        raise InvalidHash
 
-    mime_type = file_id.mime_type
-    file_name = file_id.file_name
-    disposition = "attachment"
+def media_type(file_properties: FileProperties) -> Tuple[str, str]:
+    """
+    Returns the mime type and file name to serve a media with, guessing whichever is missing.
+    """
+    mime_type = file_properties.mime_type
+    file_name = file_properties.file_name
 
     if mime_type:
         if not file_name:
@@ -148,19 +213,223 @@ async def media_streamer(request: web.Request, id: int, secure_hash: str):
                 file_name = f"{secrets.token_hex(2)}.unknown"
     else:
         if file_name:
-            mime_type = mimetypes.guess_type(file_id.file_name)
+            mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
         else:
             mime_type = "application/octet-stream"
             file_name = f"{secrets.token_hex(2)}.unknown"
+    return mime_type, file_name
 
-    return web.Response(
-        status=206 if range_header else 200,
-        body=body,
-        headers={
-            "Content-Type": f"{mime_type}",
-            "Content-Range": f"bytes {from_bytes}-{until_bytes}/{file_size}",
-            "Content-Length": str(req_length),
-            "Content-Disposition": f'{disposition}; filename="{file_name}"',
-            "Accept-Ranges": "bytes",
-        },
-    )
+async def media_streamer(request: web.Request, id: int, secure_hash: str, link: Optional[FileProperties] = None):
+    if request.method == "HEAD":
+        file_properties = link or await lookup_file_properties(id, secure_hash)
+        return await media_response(request, id, file_properties)
+
+    # answer what sends no body before the request takes a stream slot or waits for one
+    resolved = await lookup_file_properties(id, secure_hash)
+    check_hash(id, resolved, secure_hash, link)
+    answer = conditional_response(request, link or resolved)
+    if answer:
+        return answer
+
+    try:
+        grant = stream_limits.acquire(request, id)
+    except RateLimited as e:
+        logging.info(f"Refusing message with ID {id} to {client_ip(request)}, {e.limit} reached")
+        raise web.HTTPTooManyRequests(
+            text=e.message, headers={"Retry-After": str(e.retry_after), "X-Stream-Limit": e.limit}
+        )
+    try:
+        cached = known_file_properties(id)
+        try:
+            ticket = await admission.admit(cached.dc_id if cached else None)
+        except ServerBusy as e:
+            logging.warning(f"Refusing message with ID {id}, all clients are busy")
+            raise web.HTTPServiceUnavailable(text=e.message, headers={"Retry-After": str(e.retry_after)})
+        if ticket is None:
+            raise no_client_available(id)
+        try:
+            return await stream_media(request, id, secure_hash, ticket, grant, link)
+        finally:
+            ticket.release()
+    finally:
+        grant.release()
+
+
+async def stream_media(
+    request: web.Request,
+    id: int,
+    secure_hash: str,
+    ticket: Ticket,
+    grant: Grant,
+    link: Optional[FileProperties] = None,
+):
+    index = ticket.index
+    if MULTI_CLIENT:
+        logging.info(f"Client {index} is now serving {request.remote}")
+
+    tg_connect = get_streamer(index)
+    logging.debug("before calling get_file_properties")
+    file_properties = await tg_connect.get_file_properties(id)
+    logging.debug("after calling get_file_properties")
+
+    check_hash(id, file_properties, secure_hash, link)
+    return await media_response(request, id, file_properties, tg_connect, ticket, grant)
+
+
+def conditional_response(request: web.Request, file_properties: FileProperties) -> Optional[web.Response]:
+    """
+    Returns the 304 for a request whose validators still match, or the 416 for a Range
+    that cannot be satisfied, or None when the request is answered with the media.
+    """
+    etag = make_etag(file_properties)
+    last_modified = make_last_modified(file_properties)
+    if is_not_modified(request, etag, last_modified):
+        validators = {"ETag": etag}
+        if last_modified:
+            validators["Last-Modified"] = http_date(last_modified)
+        return web.Response(status=304, headers=validators)
+    try:
+        parse_range(request.headers.get("Range"), file_properties.file_size)
+    except RangeNotSatisfiable as e:
+        return web.Response(
+            status=416,
+            body=f"416: {e.message}",
+            headers={"Content-Range": f"bytes */{file_properties.file_size}"},
+        )
+    return None
+
+
+async def media_response(
+    request: web.Request,
+    id: int,
+    file_properties: FileProperties,
+    tg_connect: Optional[ByteStreamer] = None,
+    ticket: Optional[Ticket] = None,
+    grant: Optional[Grant] = None,
+):
+    answer = conditional_response(request, file_properties)
+    if answer:
+        return answer
+
+    file_size = file_properties.file_size
+    mime_type, file_name = media_type(file_properties)
+    disposition = "attachment"
+
+    etag = make_etag(file_properties)
+    last_modified = make_last_modified(file_properties)
+    validators = {"ETag": etag}
+    if last_modified:
+        validators["Last-Modified"] = http_date(last_modified)
+
+    ranges = parse_range(request.headers.get("Range"), file_size)
+    if ranges and not if_range_matches(request, etag, last_modified):
+        logging.debug(f"If-Range does not match message with ID {id}, serving the whole file")
+        ranges = None
+
+    status = 206 if ranges else 200
+    if not ranges:
+        ranges = [(0, file_size - 1)]
+
+    headers = {
+        "Content-Disposition": f'{disposition}; filename="{file_name}"',
+        "Accept-Ranges": "bytes",
+        **validators,
+        **(grant.headers() if grant else {}),
+    }
+    part_headers = boundary = None
+    if len(ranges) == 1:
+        from_bytes, until_bytes = ranges[0]
+        headers["Content-Type"] = f"{mime_type}"
+        headers["Content-Length"] = str(until_bytes - from_bytes + 1)
+        if status == 206:
+            headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{file_size}"
+    else:
+        boundary = secrets.token_hex(16)
+        part_headers = multipart_headers(ranges, file_size, mime_type, boundary)
+        headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        headers["Content-Length"] = str(multipart_length(ranges, part_headers, boundary))
+
+    if request.method == "HEAD":
+        return web.Response(status=status, headers=headers)
+
+    cached_path = chunk_cache.get_file_path(id, file_size) if chunk_cache else None
+    if cached_path:
+        logging.debug(f"Serving message with ID {id} from the local chunk cache")
+        ticket.release()
+        return await send_cached_file(
+            request, web.StreamResponse(status=status, headers=headers), cached_path, ranges, part_headers, boundary, grant
+        )
+
+    parts = [part for first, last in ranges for part in plan_parts(first, last, file_size)]
+    state = StreamState(request.remote)
+    state.on_slow.append(ticket.release)
+
+    indexes = [ticket.index]
+    if STRIPED_STREAM and len(parts) > 1 and len(multi_clients) > 1:
+        indexes = admission.stripe(ticket, file_properties.dc_id, STRIPE_CLIENTS)
+    if len(indexes) > 1:
+        logging.debug(f"Striping message with ID {id} across clients {indexes}")
+        body = yield_file_striped({i: get_streamer(i) for i in indexes}, id, parts, state, ticket)
+    else:
+        body = tg_connect.yield_file(file_properties, ticket.index, parts, state, ticket)
+
+    if part_headers:
+        body = multipart_body(body, ranges, part_headers, boundary)
+    if grant.shaped:
+        body = shape(body, grant)
+
+    return await stream_writer.write(request, web.StreamResponse(status=status, headers=headers), body, state)
+
+
+async def send_cached_file(
+    request: web.Request,
+    response: web.StreamResponse,
+    path: str,
+    ranges: List[Tuple[int, int]],
+    part_headers: Optional[List[bytes]],
+    boundary: Optional[str],
+    grant: Optional[Grant] = None,
+) -> web.StreamResponse:
+    """
+    Writes ranges of a fully cached file with the kernel's sendfile, falling back to
+    reads in a thread where sendfile is not available. A shaped stream is sent in
+    SLICE_SIZE pieces paced to its bandwidth. A failure once the headers are out
+    aborts the connection.
+    """
+    loop = asyncio.get_running_loop()
+    shaped = grant is not None and grant.shaped
+    sent = 0
+    with open(path, "rb") as f:
+        writer = await response.prepare(request)
+        try:
+            for n, (first, last) in enumerate(ranges):
+                if part_headers:
+                    await response.write(part_headers[n])
+                    await writer.drain()
+                end = last + 1
+                step = SLICE_SIZE if shaped else max(end - first, 1)
+                for offset in range(first, end, step):
+                    count = min(step, end - offset)
+                    if shaped:
+                        await grant.pace(count)
+                    try:
+                        if request.transport is None:
+                            raise ConnectionResetError("Connection lost")
+                        await loop.sendfile(request.transport, f, offset, count)
+                    except NotImplementedError:
+                        f.seek(offset)
+                        remaining = count
+                        while remaining > 0:
+                            data = await asyncio.to_thread(f.read, min(remaining, 1024 * 1024))
+                            if not data:
+                                raise OSError(f"Cached file {path} is shorter than expected")
+                            await response.write(data)
+                            remaining -= len(data)
+                    sent += count
+            if part_headers:
+                await response.write(f"\r\n--{boundary}--\r\n".encode())
+            await response.write_eof()
+        except Exception as e:
+            log_failed_stream(request.remote, sent, e)
+            stream_writer.abort(request, response)
+    return response
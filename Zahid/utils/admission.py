@@ -0,0 +1,187 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Collection, Deque, Dict, List, Optional, Tuple
+from Zahid.server.exceptions import ServerBusy
+from config import MAX_STREAMS_PER_CLIENT, STREAM_QUEUE_SIZE, STREAM_QUEUE_TIMEOUT
+from .load_balancer import EWMA_ALPHA, balancer
+from .client_health import client_health
+
+# seconds between checks of a queued request for a client that left quarantine
+RECHECK_INTERVAL = 1
+
+
+class Ticket:
+    """The stream slots one stream holds from admission until it ends, one per client it fetches through."""
+    __slots__ = ("admission", "indexes", "released")
+
+    def __init__(self, admission: "Admission", index: int):
+        self.admission = admission
+        self.indexes = [index]
+        self.released = False
+
+    @property
+    def index(self) -> int:
+        return self.indexes[0]
+
+    def move(self, old: int, new: int) -> None:
+        """
+        Moves the slot held on old to new, whose slot the caller already took with Admission.pick.
+        """
+        if self.released or old not in self.indexes:
+            self.admission.release(new)
+            return
+        self.indexes[self.indexes.index(old)] = new
+        self.admission.release(old)
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            for index in self.indexes:
+                self.admission.release(index)
+
+
+class Admission:
+    def __init__(self, max_streams: int, queue_size: int, timeout: float):
+        """Limits the streams each client serves at once and queues requests over the limit.
+        attributes:
+            max_streams: streams a client may serve at once, 0 for no limit.
+            queue_size: requests allowed to wait for a free slot before new ones are refused.
+            timeout: seconds a request waits in the queue before it is refused.
+            active: admitted streams per client index.
+            waiters: the queued requests with the DC of their file, served first come first served.
+
+        functions:
+            admit: returns a Ticket for the best client with a free slot, waiting in the queue if there is none.
+            stripe: adds slots on more clients to a Ticket, for a striped stream.
+            release: frees a slot and hands it to the request at the head of the queue.
+        """
+        self.max_streams = max_streams
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active: Dict[int, int] = {}
+        self.waiters: Deque[Tuple[asyncio.Future, Optional[int]]] = deque()
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.average_wait = 0.0
+        self.max_wait = 0.0
+
+    def pick(self, dc_id: Optional[int], exclude: Collection[int] = ()) -> Optional[int]:
+        """
+        Returns the best ranked client that still has a free slot, taking the slot.
+        """
+        for index in balancer.rank(dc_id):
+            if index in exclude:
+                continue
+            if not self.max_streams or self.active.get(index, 0) < self.max_streams:
+                client_health.acquire(index)
+                self.active[index] = self.active.get(index, 0) + 1
+                return index
+        return None
+
+    async def admit(self, dc_id: Optional[int] = None) -> Optional[Ticket]:
+        """
+        Returns a Ticket for a client with a free slot, or None when no client is healthy
+        at all, which waiting would not fix. Raises ServerBusy when the queue is full or
+        the wait runs past the timeout.
+        """
+        if not balancer.rank(dc_id):
+            return None
+        self.wake()
+        if not self.waiters:
+            index = self.pick(dc_id)
+            if index is not None:
+                return Ticket(self, index)
+        if len(self.waiters) >= self.queue_size:
+            self.rejected += 1
+            raise ServerBusy(self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append((waiter, dc_id))
+        self.queued += 1
+        started = time.monotonic()
+        deadline = started + self.timeout
+        try:
+            while not waiter.done() and time.monotonic() < deadline:
+                await asyncio.wait({waiter}, timeout=min(RECHECK_INTERVAL, deadline - time.monotonic()))
+                self.wake()
+            if not waiter.done():
+                waiter.cancel()
+                self.timed_out += 1
+                logging.warning(f"Request waited {self.timeout}s in the stream queue, refusing it")
+                raise ServerBusy(self.retry_after())
+            index = waiter.result()
+        except asyncio.CancelledError:
+            if not waiter.cancel() and not waiter.cancelled():
+                self.release(waiter.result())
+            raise
+        finally:
+            self.discard(waiter)
+            self.record_wait(time.monotonic() - started)
+        return Ticket(self, index)
+
+    def stripe(self, ticket: Ticket, dc_id: Optional[int], count: int) -> List[int]:
+        """
+        Takes slots on up to count clients in total for the stream of ticket, always
+        including the client it was admitted to. Queued requests come first, so no
+        slot is added while any are waiting.
+        """
+        while len(ticket.indexes) < count and not self.waiters:
+            index = self.pick(dc_id, ticket.indexes)
+            if index is None:
+                break
+            ticket.indexes.append(index)
+        return list(ticket.indexes)
+
+    def discard(self, waiter: asyncio.Future) -> None:
+        """
+        Removes a request that gave up from the queue, if a free slot did not already take it out.
+        """
+        for entry in self.waiters:
+            if entry[0] is waiter:
+                self.waiters.remove(entry)
+                return
+
+    def release(self, index: int) -> None:
+        self.active[index] -= 1
+        self.wake()
+
+    def wake(self) -> None:
+        """
+        Hands free slots to the queued requests in arrival order, dropping the ones that gave up.
+        """
+        while self.waiters:
+            waiter, dc_id = self.waiters[0]
+            if waiter.done():
+                self.waiters.popleft()
+                continue
+            index = self.pick(dc_id)
+            if index is None:
+                return
+            self.waiters.popleft()
+            waiter.set_result(index)
+
+    def record_wait(self, wait: float) -> None:
+        self.average_wait += EWMA_ALPHA * (wait - self.average_wait)
+        self.max_wait = max(self.max_wait, wait)
+
+    def retry_after(self) -> int:
+        return max(1, round(self.average_wait or self.timeout))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_streams_per_client": self.max_streams or None,
+            "active": dict(("bot" + str(index + 1), count) for index, count in sorted(self.active.items())),
+            "queue_depth": len(self.waiters),
+            "queue_size": self.queue_size,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "average_wait_ms": round(self.average_wait * 1000),
+            "max_wait_ms": round(self.max_wait * 1000),
+        }
+
+
+admission = Admission(MAX_STREAMS_PER_CLIENT, STREAM_QUEUE_SIZE, STREAM_QUEUE_TIMEOUT)
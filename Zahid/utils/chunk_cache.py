@@ -0,0 +1,228 @@
+import os
+import asyncio
+import logging
+import secrets
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+from config import CHUNK_CACHE_DIR, CHUNK_CACHE_SIZE, HOT_CACHE_SIZE
+
+# chunk index under which a fully assembled file is tracked
+FULL_FILE = -1
+
+
+class DiskChunkCache:
+    def __init__(self, path: str, max_size: int, chunk_size: int = 1024 * 1024):
+        """A size bounded LRU cache of media chunks stored on local disk.
+        attributes:
+            path: the directory the chunks are stored in, one sub directory per message.
+            max_size: the maximum number of bytes kept on disk.
+            chunk_size: the size of the cached chunks.
+            entries: the cached chunks keyed by (message id, chunk index), least recently used first.
+
+        Once every chunk of a message is cached they are joined into a single file,
+        which can be served directly with sendfile. Files already on disk are picked up again on startup.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.entries: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self.assembling = set()
+        self.writing = set()
+        os.makedirs(self.path, exist_ok=True)
+        self.load()
+
+    def chunk_path(self, id: int, index: int) -> str:
+        if index == FULL_FILE:
+            return os.path.join(self.path, str(id), "full")
+        return os.path.join(self.path, str(id), str(index))
+
+    def load(self) -> None:
+        """
+        Indexes the chunks left on disk by a previous run, oldest first.
+        """
+        found = []
+        for message_dir in os.scandir(self.path):
+            if not (message_dir.is_dir() and message_dir.name.isdigit()):
+                continue
+            for chunk in os.scandir(message_dir.path):
+                if chunk.name.isdigit() or chunk.name == "full":
+                    index = int(chunk.name) if chunk.name.isdigit() else FULL_FILE
+                    stat = chunk.stat()
+                    found.append((stat.st_mtime, int(message_dir.name), index, stat.st_size))
+        for _, id, index, size in sorted(found):
+            self.entries[(id, index)] = size
+            self.size += size
+        self.evict()
+        logging.info(f"Loaded {len(self.entries)} cached chunks from {self.path}")
+
+    async def get(self, id: int, index: int, start: int = 0, length: Optional[int] = None) -> Optional[bytes]:
+        """
+        Returns the cached chunk of a message, or only length bytes of it from start,
+        or None if it is not on disk.
+        """
+        key = (id, index)
+        offset = start
+        if (id, FULL_FILE) in self.entries:
+            key = (id, FULL_FILE)
+            offset += index * self.chunk_size
+        elif key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        try:
+            return await asyncio.to_thread(self._read, self.chunk_path(*key), offset, length or self.chunk_size - start)
+        except OSError:
+            self._discard(key)
+            return None
+
+    async def put(self, id: int, index: int, data: bytes) -> None:
+        """
+        Stores a chunk of a message and evicts the least recently used chunks over the size budget.
+        """
+        key = (id, index)
+        if (
+            key in self.entries
+            or key in self.writing
+            or (id, FULL_FILE) in self.entries
+            or len(data) > self.max_size
+        ):
+            return
+        self.writing.add(key)
+        try:
+            await asyncio.to_thread(self._write, self.chunk_path(id, index), data)
+        except OSError as e:
+            logging.warning(f"Could not cache chunk {index} of message {id}: {e}")
+            return
+        finally:
+            self.writing.discard(key)
+        self.size += len(data) - self.entries.get(key, 0)
+        self.entries[key] = len(data)
+        self.evict()
+
+    def get_file_path(self, id: int, file_size: int) -> Optional[str]:
+        """
+        Returns the path of the fully cached file of a message, or None if it is not complete yet.
+        When every chunk is cached but not yet joined, they are joined in the background.
+        """
+        key = (id, FULL_FILE)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.chunk_path(*key)
+        chunk_count = -(-file_size // self.chunk_size)
+        if (
+            file_size
+            and id not in self.assembling
+            and all((id, index) in self.entries for index in range(chunk_count))
+        ):
+            self.assembling.add(id)
+            asyncio.create_task(self.assemble(id, chunk_count))
+        return None
+
+    async def assemble(self, id: int, chunk_count: int) -> None:
+        """
+        Joins the cached chunks of a message into a single file and drops the chunks.
+        """
+        paths = [self.chunk_path(id, index) for index in range(chunk_count)]
+        try:
+            size = await asyncio.to_thread(self._join, paths, self.chunk_path(id, FULL_FILE))
+        except OSError as e:
+            logging.warning(f"Could not assemble cached file of message {id}: {e}")
+            return
+        finally:
+            self.assembling.discard(id)
+        for index in range(chunk_count):
+            self._discard((id, index))
+        self.entries[(id, FULL_FILE)] = size
+        self.size += size
+        self.evict()
+        logging.debug(f"Assembled cached file of message {id}")
+
+    def evict(self) -> None:
+        while self.size > self.max_size and self.entries:
+            key, _ = next(iter(self.entries.items()))
+            self._discard(key)
+
+    def _discard(self, key: Tuple[int, int]) -> None:
+        size = self.entries.pop(key, None)
+        if size is None:
+            return
+        self.size -= size
+        try:
+            os.remove(self.chunk_path(*key))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _read(path: str, offset: int, length: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    @staticmethod
+    def _join(paths: list, path: str) -> int:
+        tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+        size = 0
+        with open(tmp_path, "wb") as out:
+            for chunk_path in paths:
+                with open(chunk_path, "rb") as f:
+                    size += out.write(f.read())
+        os.replace(tmp_path, path)
+        return size
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+class MemoryChunkCache:
+    def __init__(self, max_size: int):
+        """An in-process LRU cache of recently served media chunks, bounded by total bytes.
+        attributes:
+            max_size: the maximum number of bytes kept in memory.
+            entries: the cached chunks keyed by (message id, chunk index), least recently used first.
+            hits, misses, evictions: counters for tuning the cache size.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.entries: "OrderedDict[Tuple[int, int], bytes]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, id: int, index: int) -> Optional[bytes]:
+        chunk = self.entries.get((id, index))
+        if chunk is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end((id, index))
+        self.hits += 1
+        return chunk
+
+    def put(self, id: int, index: int, data: bytes) -> None:
+        key = (id, index)
+        if key in self.entries or len(data) > self.max_size:
+            return
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chunks": len(self.entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+hot_cache = MemoryChunkCache(HOT_CACHE_SIZE * 1024 * 1024) if HOT_CACHE_SIZE else None
+chunk_cache = DiskChunkCache(CHUNK_CACHE_DIR, CHUNK_CACHE_SIZE * 1024 * 1024) if CHUNK_CACHE_SIZE else None
@@ -0,0 +1,67 @@
+from typing import List, NamedTuple, Union
+from config import WHOLE_BLOCK_READ
+
+# the largest part upload.GetFile returns, and the window no request may cross
+CHUNK_SIZE = 1024 * 1024
+# offsets and limits of upload.GetFile must be multiples of this
+MIN_PART_SIZE = 4 * 1024
+# partial reads of a block this large are fetched as the whole, cacheable block
+WHOLE_BLOCK_SIZE = WHOLE_BLOCK_READ * 1024
+
+
+class Part(NamedTuple):
+    """A single upload.GetFile request and the slice of its bytes that belongs to the response."""
+    offset: int
+    limit: int
+    start: int
+    end: int
+
+
+def plan_parts(from_bytes: int, until_bytes: int, file_size: int) -> List[Part]:
+    """
+    Plans the GetFile requests needed for the inclusive byte range from_bytes-until_bytes.
+    Every 1 MiB block the range covers completely is fetched as one full, cacheable part,
+    and so is a block the range reads WHOLE_BLOCK_SIZE or more of, like a seek into a
+    moov atom that players come back to. A smaller read of a block, as for a probe of
+    the first or last bytes or a small index, is fetched with the smallest offset/limit
+    pair that is valid for MTProto.
+    """
+    parts = []
+    last_byte = file_size - 1
+    block = from_bytes - from_bytes % CHUNK_SIZE
+    while block <= until_bytes:
+        first = max(from_bytes, block)
+        last = min(until_bytes, block + CHUNK_SIZE - 1)
+        covered = first == block and last == min(block + CHUNK_SIZE - 1, last_byte)
+        if covered or (WHOLE_BLOCK_SIZE and last - first + 1 >= WHOLE_BLOCK_SIZE):
+            offset, limit = block, CHUNK_SIZE
+        else:
+            offset, limit = exact_part(first, last)
+        parts.append(Part(offset, limit, first - offset, last - offset + 1))
+        block += CHUNK_SIZE
+    return parts
+
+
+def exact_part(first: int, last: int) -> tuple:
+    """
+    Returns the smallest (offset, limit) covering first-last within one 1 MiB block,
+    where limit is a power of two between 4 KiB and 1 MiB, offset is 4 KiB aligned
+    and the request does not cross a 1 MiB boundary.
+    """
+    limit = MIN_PART_SIZE
+    while limit <= CHUNK_SIZE:
+        for offset in (first - first % MIN_PART_SIZE, first - first % limit):
+            if offset + limit > last and offset % CHUNK_SIZE + limit <= CHUNK_SIZE:
+                return offset, limit
+        limit *= 2
+    return first - first % CHUNK_SIZE, CHUNK_SIZE
+
+
+def part_view(chunk: Union[bytes, memoryview], start: int, end: int) -> Union[bytes, memoryview]:
+    """
+    Returns chunk[start:end] as a memoryview over the same buffer instead of a copy.
+    A slice covering the whole chunk returns the chunk itself.
+    """
+    if start == 0 and end >= len(chunk):
+        return chunk
+    return memoryview(chunk)[start:end]
@@ -0,0 +1,116 @@
+import time
+import logging
+from typing import Dict, Optional
+from pyrogram.errors import AuthBytesInvalid, FloodWait, InternalServerError, ServiceUnavailable, Unauthorized
+from config import BREAKER_THRESHOLD, BREAKER_COOLDOWN
+
+HEALTHY = "healthy"
+THROTTLED = "throttled"
+BROKEN = "broken"
+# seconds after which a probe that never reported back is given up on
+PROBE_TIMEOUT = 30
+# seconds within which failures of one client count once, like the parts a stream has in flight
+FAILURE_WINDOW = 1
+# errors after which a part is worth requesting again
+RETRY_ERRORS = (OSError, FloodWait, InternalServerError, ServiceUnavailable)
+# errors that say something about the client rather than the file it was asked for
+CLIENT_ERRORS = RETRY_ERRORS + (Unauthorized, AuthBytesInvalid)
+
+
+class HealthState:
+    """The circuit breaker state of a single client."""
+    __slots__ = ("state", "until", "failures", "last_failure", "probing_since")
+
+    def __init__(self):
+        self.state = HEALTHY
+        self.until = 0.0
+        self.failures = 0
+        self.last_failure = 0.0
+        self.probing_since: Optional[float] = None
+
+
+class ClientHealth:
+    def __init__(self, threshold: int, cooldown: float):
+        """A per client circuit breaker for streaming.
+        attributes:
+            threshold: consecutive failures after which a client is marked broken.
+            cooldown: seconds a broken client is kept out of rotation.
+            states: the HealthState of each client, keyed by client index.
+
+        A client that hits a FloodWait is throttled for the wait duration. Once its
+        throttle or cooldown runs out, a single request is let through as a probe;
+        its outcome decides whether the client is healthy again. Only CLIENT_ERRORS
+        count, an invalid file or offset is the file's fault, and failures within
+        FAILURE_WINDOW of each other count as one.
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.states: Dict[int, HealthState] = {}
+
+    def get(self, index: int) -> HealthState:
+        return self.states.setdefault(index, HealthState())
+
+    def available(self, index: int) -> bool:
+        health = self.get(index)
+        if health.state == HEALTHY:
+            return True
+        now = time.monotonic()
+        if health.until > now:
+            return False
+        return health.probing_since is None or now - health.probing_since > PROBE_TIMEOUT
+
+    def acquire(self, index: int) -> None:
+        """
+        Marks a request as the probe of a client that is leaving quarantine.
+        """
+        health = self.get(index)
+        if health.state != HEALTHY:
+            health.probing_since = time.monotonic()
+            logging.info(f"Probing {health.state} client {index}")
+
+    def success(self, index: int) -> None:
+        health = self.get(index)
+        if health.state != HEALTHY:
+            logging.info(f"Client {index} is healthy again")
+        health.state = HEALTHY
+        health.failures = 0
+        health.probing_since = None
+
+    def failure(self, index: int, error: Exception) -> None:
+        health = self.get(index)
+        health.probing_since = None
+        if not isinstance(error, CLIENT_ERRORS):
+            return
+        now = time.monotonic()
+        if isinstance(error, FloodWait):
+            health.state = THROTTLED
+            health.until = now + error.value
+            logging.warning(f"Client {index} throttled for {error.value}s by FloodWait")
+            return
+        if now - health.last_failure < FAILURE_WINDOW:
+            return
+        health.last_failure = now
+        health.failures += 1
+        if health.state != HEALTHY or health.failures >= self.threshold:
+            health.state = BROKEN
+            health.until = now + self.cooldown
+            logging.warning(f"Client {index} broken after {health.failures} failures: {error!r}")
+
+    def retry_after(self) -> int:
+        """
+        Returns the seconds until the first quarantined client can be probed.
+        """
+        now = time.monotonic()
+        waits = [h.until - now for h in self.states.values() if h.state != HEALTHY]
+        return max(1, int(min(waits, default=1)) + 1)
+
+    def describe(self, index: int) -> Dict[str, object]:
+        health = self.get(index)
+        return {
+            "state": health.state,
+            "failures": health.failures,
+            "retry_in": max(0, round(health.until - time.monotonic())) if health.state != HEALTHY else 0,
+        }
+
+
+client_health = ClientHealth(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
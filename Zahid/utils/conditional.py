@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from aiohttp import web
+from .file_properties import FileProperties
+
+
+def make_etag(file_properties: FileProperties) -> str:
+    """
+    Returns a strong ETag for a media file, derived from its unique ID and size.
+    """
+    return f'"{file_properties.unique_id}-{file_properties.file_size}"'
+
+
+def make_last_modified(file_properties: FileProperties) -> Optional[datetime]:
+    """
+    Returns the date of the DB_CHANNEL message, in UTC and whole seconds.
+    """
+    date = file_properties.date
+    if not date:
+        return None
+    if date.tzinfo is None:
+        date = date.astimezone()
+    return date.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def http_date(date: datetime) -> str:
+    return format_datetime(date, usegmt=True)
+
+
+def parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+def is_not_modified(request: web.Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    Evaluates If-None-Match, or If-Modified-Since when there is no If-None-Match, as in RFC 7232.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since and last_modified:
+        since = parse_http_date(if_modified_since)
+        return since is not None and last_modified <= since
+    return False
+
+
+def if_range_matches(request: web.Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    Returns whether the Range header should be honoured. An If-Range with a strong ETag
+    or the exact Last-Modified date keeps it; anything else asks for the whole file.
+    """
+    if_range = request.headers.get("If-Range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith("W/"):
+        return False
+    date = parse_http_date(if_range)
+    return date is not None and last_modified is not None and date == last_modified
@@ -1,117 +1,235 @@
 import math
+import time
 import asyncio
 import logging
-from config import DB_CHANNEL
-from typing import Dict, Union
-from Zahid.bot import work_loads
+from collections import deque
+from config import (
+    DB_CHANNEL,
+    FILE_CACHE_SIZE,
+    FILE_CACHE_TTL,
+    FILE_STORE_PRELOAD,
+    MEDIA_SESSION_IDLE,
+    MEDIA_SESSION_POOL,
+    SESSION_KEEPALIVE,
+    STREAM_FAILOVERS,
+    STREAM_RETRIES,
+    STREAM_RETRY_BACKOFF,
+    STREAM_READ_AHEAD,
+    STREAM_BUFFER_LIMIT,
+)
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Union
+from Zahid.bot import multi_clients, work_loads
 from pyrogram import Client, utils, raw
-from .file_properties import get_file_ids
+from .chunk_cache import chunk_cache, hot_cache
+from .chunk_planner import CHUNK_SIZE, Part, part_view
+from .lru_cache import TTLCache
+from .load_balancer import balancer
+from .client_health import CLIENT_ERRORS, RETRY_ERRORS, client_health
+from .admission import Ticket, admission
+from .file_properties import FileProperties, get_file_ids
+from .file_store import file_store
+from .stream_writer import StreamState
 from pyrogram.session import Session, Auth
-from pyrogram.errors import AuthBytesInvalid
+from pyrogram.errors import AuthBytesInvalid, FileReferenceExpired, FileReferenceInvalid, FloodWait
 from Zahid.server.exceptions import FIleNotFound
 from pyrogram.file_id import FileId, FileType, ThumbnailSource
 
 
 class ByteStreamer:
-    def __init__(self, client: Client):
+    def __init__(self, client: Client, index: int = 0):
         """A custom class that holds the cache of a specific client and class functions.
         attributes:
             client: the client that the cache is for.
-            cached_file_ids: a dict of cached file IDs.
-            cached_file_properties: a dict of cached file properties.
+            index: the index of the client in multi_clients.
+            cached_file_ids: an LRU/TTL cache of FileProperties keyed by message ID.
+            pending_file_ids: in-flight lookups keyed by message ID, shared by concurrent requests.
+            media_sessions: the pool of media sessions of the client keyed by DC.
+            session_used: when each pooled media session was last handed out.
         
         functions:
             generate_file_properties: returns the properties for a media of a specific message contained in Tuple.
             generate_media_session: returns the media session for the DC that contains the media file.
+            check_media_sessions: closes idle extra media sessions and pings the ones kept.
+            get_chunk: returns a part of the media file, from the chunk caches when possible.
             yield_file: yield a file from telegram servers for streaming.
             
         This is a modified version of the <https://github.com/eyaadh/megadlbot_oss/blob/master/mega/telegram/utils/custom_download.py>
         Thanks to Eyaadh <https://github.com/eyaadh>
         """
-        self.clean_timer = 30 * 60
         self.client: Client = client
-        self.cached_file_ids: Dict[int, FileId] = {}
-        asyncio.create_task(self.clean_cache())
+        self.index = index
+        self.cached_file_ids = TTLCache(FILE_CACHE_SIZE, FILE_CACHE_TTL)
+        self.pending_file_ids: Dict[int, asyncio.Task] = {}
+        self.media_sessions: Dict[int, List[Session]] = {}
+        self.session_locks: Dict[int, asyncio.Lock] = {}
+        self.session_turns: Dict[int, int] = {}
+        self.session_used: Dict[Session, float] = {}
 
-    async def get_file_properties(self, id: int) -> FileId:
+    async def get_file_properties(self, id: int) -> FileProperties:
         """
-        Returns the properties of a media of a specific message in a FIleId class.
+        Returns the properties of a media of a specific message in a FileProperties class.
         if the properties are cached, then it'll return the cached results.
         or it'll generate the properties from the Message ID and cache them.
+        Concurrent lookups for the same message share a single request to Telegram.
         """
-        if id not in self.cached_file_ids:
-            await self.generate_file_properties(id)
+        file_properties = self.cached_file_ids.get(id)
+        if file_properties is None:
+            file_properties = await self.single_flight(id)
             logging.debug(f"Cached file properties for message with ID {id}")
-        return self.cached_file_ids[id]
+        return file_properties
+
+    async def single_flight(self, id: int) -> FileProperties:
+        """
+        Generates the properties of a message, joining the lookup already in flight for it if there is one.
+        """
+        task = self.pending_file_ids.get(id)
+        if task is None:
+            task = asyncio.create_task(self.generate_file_properties(id))
+            self.pending_file_ids[id] = task
+            task.add_done_callback(lambda _: self.pending_file_ids.pop(id, None))
+        else:
+            logging.debug(f"Joining in-flight lookup for message with ID {id}")
+        return await asyncio.shield(task)
     
-    async def generate_file_properties(self, id: int) -> FileId:
+    async def refresh_file_properties(self, stale: FileProperties) -> FileProperties:
+        """
+        Replaces cached properties whose file reference expired with freshly fetched ones.
+        If another request already refreshed them, the cached properties are returned as they are.
+        """
+        id = stale.message_id
+        cached = self.cached_file_ids.peek(id)
+        if cached is not None and cached.file_id.file_reference != stale.file_id.file_reference:
+            return cached
+        self.cached_file_ids.pop(id)
+        return await self.single_flight(id)
+
+    async def generate_file_properties(self, id: int) -> FileProperties:
         """
         Generates the properties of a media file on a specific message.
-        returns ths properties in a FIleId class.
+        returns ths properties in a FileProperties class.
         """
-        file_id = await get_file_ids(self.client, DB_CHANNEL, id)
+        file_properties = await get_file_ids(self.client, DB_CHANNEL, id)
         logging.debug(f"Generated file ID and Unique ID for message with ID {id}")
-        if not file_id:
+        if not file_properties:
             logging.debug(f"Message with ID {id} not found")
             raise FIleNotFound
-        self.cached_file_ids[id] = file_id
+        self.cached_file_ids.set(id, file_properties)
+        file_store.save(self.client, file_properties)
         logging.debug(f"Cached media message with ID {id}")
-        return self.cached_file_ids[id]
+        return file_properties
 
     async def generate_media_session(self, client: Client, file_id: FileId) -> Session:
         """
         Generates the media session for the DC that contains the media file.
         This is required for getting the bytes from Telegram servers.
         """
+        return await self.get_media_session(client, file_id.dc_id)
 
-        media_session = client.media_sessions.get(file_id.dc_id, None)
+    async def get_media_session(self, client: Client, dc_id: int) -> Session:
+        """
+        Returns a media session for a DC. Sessions are created under a per DC lock, and up
+        to MEDIA_SESSION_POOL of them are kept per DC, handed out in turn.
+        """
+        pool = self.media_sessions.setdefault(dc_id, [])
+        lock = self.session_locks.setdefault(dc_id, asyncio.Lock())
 
-        if media_session is None:
-            if file_id.dc_id != await client.storage.dc_id():
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await Auth(
-                        client, file_id.dc_id, await client.storage.test_mode()
-                    ).create(),
-                    await client.storage.test_mode(),
-                    is_media=True,
-                )
-                await media_session.start()
+        if len(pool) < MEDIA_SESSION_POOL and not (pool and lock.locked()):
+            async with lock:
+                if not pool and client.media_sessions.get(dc_id):
+                    logging.debug(f"Using cached media session for DC {dc_id}")
+                    pool.append(client.media_sessions[dc_id])
+                elif len(pool) < MEDIA_SESSION_POOL:
+                    pool.append(await self.create_media_session(client, dc_id))
+                    client.media_sessions.setdefault(dc_id, pool[0])
 
-                for _ in range(6):
-                    exported_auth = await client.invoke(
-                        raw.functions.auth.ExportAuthorization(dc_id=file_id.dc_id)
-                    )
+        turn = self.session_turns.get(dc_id, -1) + 1
+        self.session_turns[dc_id] = turn
+        media_session = pool[turn % len(pool)]
+        self.session_used[media_session] = time.monotonic()
+        return media_session
 
+    async def check_media_sessions(self) -> None:
+        """
+        Closes pooled media sessions beyond the first of a DC once they sat idle for
+        MEDIA_SESSION_IDLE seconds, and pings the ones kept that were idle for a
+        SESSION_KEEPALIVE interval. A session that fails its ping is dropped, so the
+        next request for its DC does not wait on a dead connection.
+        """
+        now = time.monotonic()
+        for dc_id, pool in list(self.media_sessions.items()):
+            for media_session in list(pool):
+                idle = now - self.session_used.setdefault(media_session, now)
+                if media_session is not pool[0] and idle > MEDIA_SESSION_IDLE:
+                    logging.debug(f"Closing media session for DC {dc_id} of client {self.index}, idle for {idle:.0f}s")
+                    await self.drop_media_session(dc_id, media_session)
+                elif idle > SESSION_KEEPALIVE:
                     try:
-                        await media_session.send(
-                            raw.functions.auth.ImportAuthorization(
-                                id=exported_auth.id, bytes=exported_auth.bytes
-                            )
-                        )
-                        break
-                    except AuthBytesInvalid:
-                        logging.debug(
-                            f"Invalid authorization bytes for DC {file_id.dc_id}"
+                        await media_session.send(raw.functions.Ping(ping_id=0), timeout=SESSION_KEEPALIVE / 2)
+                    except Exception as e:
+                        logging.warning(f"Media session for DC {dc_id} of client {self.index} failed its keepalive: {e!r}")
+                        await self.drop_media_session(dc_id, media_session)
+
+    async def drop_media_session(self, dc_id: int, media_session: Session) -> None:
+        async with self.session_locks.setdefault(dc_id, asyncio.Lock()):
+            pool = self.media_sessions.get(dc_id, [])
+            if media_session in pool:
+                pool.remove(media_session)
+            self.session_used.pop(media_session, None)
+            if self.client.media_sessions.get(dc_id) is media_session:
+                self.client.media_sessions.pop(dc_id)
+        try:
+            await media_session.stop()
+        except Exception:
+            logging.debug(f"Error stopping media session for DC {dc_id}", exc_info=True)
+
+    @staticmethod
+    async def create_media_session(client: Client, dc_id: int) -> Session:
+        """
+        Creates and starts a new media session for a DC, exporting the authorization
+        of the client when the DC is not its home DC.
+        """
+        if dc_id != await client.storage.dc_id():
+            media_session = Session(
+                client,
+                dc_id,
+                await Auth(
+                    client, dc_id, await client.storage.test_mode()
+                ).create(),
+                await client.storage.test_mode(),
+                is_media=True,
+            )
+            await media_session.start()
+
+            for _ in range(6):
+                exported_auth = await client.invoke(
+                    raw.functions.auth.ExportAuthorization(dc_id=dc_id)
+                )
+
+                try:
+                    await media_session.send(
+                        raw.functions.auth.ImportAuthorization(
+                            id=exported_auth.id, bytes=exported_auth.bytes
                         )
-                        continue
-                else:
-                    await media_session.stop()
-                    raise AuthBytesInvalid
+                    )
+                    break
+                except AuthBytesInvalid:
+                    logging.debug(
+                        f"Invalid authorization bytes for DC {dc_id}"
+                    )
+                    continue
             else:
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await client.storage.auth_key(),
-                    await client.storage.test_mode(),
-                    is_media=True,
-                )
-                await media_session.start()
-            logging.debug(f"Created media session for DC {file_id.dc_id}")
-            client.media_sessions[file_id.dc_id] = media_session
+                await media_session.stop()
+                raise AuthBytesInvalid
         else:
-            logging.debug(f"Using cached media session for DC {file_id.dc_id}")
+            media_session = Session(
+                client,
+                dc_id,
+                await client.storage.auth_key(),
+                await client.storage.test_mode(),
+                is_media=True,
+            )
+            await media_session.start()
+        logging.debug(f"Created media session for DC {dc_id}")
         return media_session
 
 
@@ -160,72 +278,298 @@ class ByteStreamer:
             )
         return location
 
+    @staticmethod
+    async def fetch_part(
+        media_session: Session,
+        location: Union[raw.types.InputPhotoFileLocation,
+                        raw.types.InputDocumentFileLocation,
+                        raw.types.InputPeerPhotoFileLocation,],
+        offset: int,
+        chunk_size: int,
+    ) -> bytes:
+        """
+        Requests a single part of the media file from Telegram servers.
+        Returns empty bytes if the response does not carry file bytes.
+        """
+        r = await media_session.send(
+            raw.functions.upload.GetFile(
+                location=location, offset=offset, limit=chunk_size
+            ),
+        )
+        if isinstance(r, raw.types.upload.File):
+            return r.bytes
+        return b""
+
+    async def get_chunk(self, file_properties: FileProperties, offset: int, limit: int) -> Union[bytes, memoryview]:
+        """
+        Returns a part of the media file, from the local chunk caches if the 1 MiB block
+        holding it is there, otherwise from Telegram servers through the media session of the file's DC.
+        Only full blocks are added to the caches. Parts of cached blocks are returned as memoryviews.
+        A part refused for an expired file reference is requested once more with refreshed properties.
+        """
+        id = file_properties.message_id
+        index = offset // CHUNK_SIZE
+        cut = offset - index * CHUNK_SIZE
+        if hot_cache:
+            chunk = hot_cache.get(id, index)
+            if chunk is not None:
+                return part_view(chunk, cut, cut + limit)
+        if chunk_cache and hot_cache:
+            chunk = await chunk_cache.get(id, index)
+            if chunk is not None:
+                hot_cache.put(id, index, chunk)
+                return part_view(chunk, cut, cut + limit)
+        elif chunk_cache:
+            chunk = await chunk_cache.get(id, index, cut, limit)
+            if chunk is not None:
+                return chunk
+
+        for refreshed in (False, True):
+            try:
+                media_session = await self.generate_media_session(self.client, file_properties.file_id)
+                location = await self.get_location(file_properties.file_id)
+                start = time.monotonic()
+                chunk = await self.fetch_part(media_session, location, offset, limit)
+                break
+            except (FileReferenceExpired, FileReferenceInvalid):
+                if refreshed:
+                    raise
+                logging.debug(f"File reference of message with ID {id} expired, refreshing")
+                file_properties = await self.refresh_file_properties(file_properties)
+            except Exception as e:
+                if isinstance(e, CLIENT_ERRORS):
+                    balancer.record(self.index, error=True)
+                client_health.failure(self.index, e)
+                raise
+        balancer.record(self.index, latency=time.monotonic() - start)
+        client_health.success(self.index)
+        if chunk and limit == CHUNK_SIZE:
+            if hot_cache:
+                hot_cache.put(id, index, chunk)
+            if chunk_cache:
+                await chunk_cache.put(id, index, chunk)
+        return chunk
+
     async def yield_file(
         self,
-        file_id: FileId,
+        file_properties: FileProperties,
         index: int,
-        offset: int,
-        first_part_cut: int,
-        last_part_cut: int,
-        part_count: int,
-        chunk_size: int,
+        parts: List[Part],
+        state: Optional[StreamState] = None,
+        ticket: Optional[Ticket] = None,
     ) -> Union[str, None]:
         """
-        Custom generator that yields the bytes of the media file.
+        Custom generator that yields the bytes of the media file covered by the planned parts.
+        Up to STREAM_READ_AHEAD parts are requested ahead of the one being yielded,
+        bounded by STREAM_BUFFER_LIMIT, and parts are always yielded in order.
+        Once the response writer marks the stream slow, the stream gives up its work load slot.
         Modded from <https://github.com/eyaadh/megadlbot_oss/blob/master/mega/telegram/utils/custom_download.py#L20>
         Thanks to Eyaadh <https://github.com/eyaadh>
         """
-        client = self.client
-        work_loads[index] += 1
         logging.debug(f"Starting to yielding file with client {index}.")
-        media_session = await self.generate_media_session(client, file_id)
+        fetcher = PartFetcher(self, file_properties, ticket)
+        fetcher.acquire()
+        if state:
+            state.on_slow.append(fetcher.release)
+        try:
+            async for chunk in yield_parts([fetcher], STREAM_READ_AHEAD, parts, state):
+                yield chunk
+        finally:
+            fetcher.release()
 
-        current_part = 1
-        location = await self.get_location(file_id)
 
+class_cache: Dict[Client, ByteStreamer] = {}
+
+
+def get_streamer(index: int) -> ByteStreamer:
+    """
+    Returns the ByteStreamer of a client in multi_clients, creating it on first use.
+    """
+    client = multi_clients[index]
+    if client in class_cache:
+        logging.debug(f"Using cached ByteStreamer object for client {index}")
+    else:
+        logging.debug(f"Creating new ByteStreamer object for client {index}")
+        class_cache[client] = ByteStreamer(client, index)
+    return class_cache[client]
+
+
+async def load_file_properties() -> None:
+    """
+    Fills the file property caches of every client from the file store, most recent last,
+    so that a restart does not have to look every file up again.
+    """
+    for index, client in multi_clients.items():
         try:
-            r = await media_session.send(
-                raw.functions.upload.GetFile(
-                    location=location, offset=offset, limit=chunk_size
-                ),
-            )
-            if isinstance(r, raw.types.upload.File):
-                while True:
-                    chunk = r.bytes
-                    if not chunk:
-                        break
-                    elif part_count == 1:
-                        yield chunk[first_part_cut:last_part_cut]
-                    elif current_part == 1:
-                        yield chunk[first_part_cut:]
-                    elif current_part == part_count:
-                        yield chunk[:last_part_cut]
-                    else:
-                        yield chunk
-
-                    current_part += 1
-                    offset += chunk_size
-
-                    if current_part > part_count:
-                        break
-
-                    r = await media_session.send(
-                        raw.functions.upload.GetFile(
-                            location=location, offset=offset, limit=chunk_size
-                        ),
-                    )
-        except (TimeoutError, AttributeError):
-            pass
-        finally:
-            logging.debug("Finished yielding file with {current_part} parts.")
-            work_loads[index] -= 1
+            stored = await file_store.load(client, min(FILE_STORE_PRELOAD, FILE_CACHE_SIZE))
+        except Exception:
+            logging.warning(f"Could not load stored file properties for client {index}", exc_info=True)
+            continue
+        streamer = get_streamer(index)
+        for file_properties in reversed(stored):
+            streamer.cached_file_ids.set(file_properties.message_id, file_properties)
+        logging.info(f"Loaded {len(stored)} stored file properties for client {index}")
 
-    
-    async def clean_cache(self) -> None:
-        """
-        function to clean the cache to reduce memory usage
+
+class PartFetcher:
+    def __init__(self, streamer: ByteStreamer, file_properties: FileProperties, ticket: Optional[Ticket] = None):
+        """Fetches the parts of one message for a stream.
+        attributes:
+            streamer: the ByteStreamer of the client currently serving the stream.
+            file_properties: the properties of the message as seen by that client.
+            ticket: the admission slots of the stream, if it was admitted.
+            failover: the client a failover took an admission slot on, until the stream moves there.
+
+        A failed part is retried at the same offset up to STREAM_RETRIES times with
+        exponential backoff, then on up to STREAM_FAILOVERS other clients. While the
+        stream holds its ticket, only clients with a free admission slot are tried.
+        The stream stays on the client that succeeded, and its work load and
+        admission slots move with it.
         """
-        while True:
-            await asyncio.sleep(self.clean_timer)
-            self.cached_file_ids.clear()
-            logging.debug("Cleaned the cache")
+        self.streamer = streamer
+        self.file_properties = file_properties
+        self.ticket = ticket
+        self.failover: Optional[int] = None
+        self.loaded = False
+
+    def acquire(self) -> None:
+        if not self.loaded:
+            work_loads[self.streamer.index] += 1
+            self.loaded = True
+
+    def release(self) -> None:
+        if self.loaded:
+            work_loads[self.streamer.index] -= 1
+            self.loaded = False
+
+    async def __call__(self, offset: int, limit: int) -> bytes:
+        error = None
+        # pick up properties refreshed after a file reference expired
+        self.file_properties = (
+            self.streamer.cached_file_ids.peek(self.file_properties.message_id) or self.file_properties
+        )
+        for attempt in range(STREAM_RETRIES + 1):
+            try:
+                return await self.streamer.get_chunk(self.file_properties, offset, limit)
+            except RETRY_ERRORS as e:
+                error = e
+                logging.warning(
+                    f"Client {self.streamer.index} failed part at offset {offset} "
+                    f"(attempt {attempt + 1}): {e!r}"
+                )
+                if isinstance(e, FloodWait) or not client_health.available(self.streamer.index):
+                    break
+                if attempt < STREAM_RETRIES:
+                    await asyncio.sleep(STREAM_RETRY_BACKOFF * 2 ** attempt)
+
+        tried = {self.streamer.index}
+        for _ in range(STREAM_FAILOVERS):
+            dc_id = self.file_properties.dc_id
+            if self.streamer.index not in tried:
+                # another part of the stream already failed over, follow it
+                index = self.streamer.index
+            elif self.failover is not None and self.failover not in tried:
+                # another part is failing over and holds a slot there, share it
+                index = self.failover
+            elif self.ticket is not None and not self.ticket.released:
+                index = self.failover = admission.pick(dc_id, tried | set(self.ticket.indexes))
+            else:
+                index = next((i for i in balancer.rank(dc_id) if i not in tried), None)
+            if index is None:
+                break
+            streamer = get_streamer(index)
+            tried.add(index)
+            try:
+                file_properties = await streamer.get_file_properties(self.file_properties.message_id)
+                chunk = await streamer.get_chunk(file_properties, offset, limit)
+            except RETRY_ERRORS as e:
+                if self.failover == index:
+                    self.failover = None
+                    admission.release(index)
+                error = e
+                logging.warning(f"Failover to client {index} failed at offset {offset}: {e!r}")
+                continue
+            if streamer is not self.streamer:
+                logging.info(f"Stream failed over from client {self.streamer.index} to {index}")
+                if self.failover == index:
+                    self.failover = None
+                    self.ticket.move(self.streamer.index, index)
+                loaded = self.loaded
+                self.release()
+                self.streamer, self.file_properties = streamer, file_properties
+                if loaded:
+                    self.acquire()
+            return chunk
+        raise error
+
+
+async def yield_parts(
+    fetchers: List[Callable[[int, int], Awaitable[bytes]]],
+    read_ahead: int,
+    parts: List[Part],
+    state: Optional[StreamState] = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    Yields the planned parts of a media file in order, keeping up to read_ahead parts in flight.
+    Part n is requested through fetchers[n % len(fetchers)], so passing one fetcher per
+    client stripes the download across them. The window is bounded by STREAM_BUFFER_LIMIT,
+    and shrinks to a single part once the stream is marked slow. A part that comes back
+    short raises, so the response is aborted instead of ending under its Content-Length.
+    """
+    full_window = max(1, min(read_ahead, STREAM_BUFFER_LIMIT * 1024 * 1024 // CHUNK_SIZE))
+    pending = deque()
+    current_part = 0
+    next_part = 0
+
+    try:
+        while current_part < len(parts):
+            window = 1 if state and state.slow else full_window
+            while next_part < len(parts) and len(pending) < window:
+                fetch = fetchers[next_part % len(fetchers)]
+                part = parts[next_part]
+                pending.append(asyncio.create_task(fetch(part.offset, part.limit)))
+                next_part += 1
+
+            chunk = await pending.popleft()
+            part = parts[current_part]
+            if len(chunk) < part.end:
+                raise EOFError(f"Part at offset {part.offset} returned {len(chunk)} of {part.end} bytes")
+            yield part_view(chunk, part.start, part.end)
+            current_part += 1
+    except RETRY_ERRORS as e:
+        logging.error(f"Aborting stream after {current_part} of {len(parts)} parts: {e!r}")
+        raise
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        logging.debug(f"Finished yielding file with {current_part} parts.")
+
+
+async def yield_file_striped(
+    streamers: Dict[int, ByteStreamer],
+    id: int,
+    parts: List[Part],
+    state: Optional[StreamState] = None,
+    ticket: Optional[Ticket] = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    Yields the bytes of the media file of a message, fetching the parts concurrently
+    through every client in streamers. Each client resolves its own FileId and media
+    session, and the parts are reassembled in order.
+    """
+    fetchers = []
+    logging.debug(f"Starting to yield striped file with clients {list(streamers)}.")
+    try:
+        for streamer in streamers.values():
+            file_properties = await streamer.get_file_properties(id)
+            fetchers.append(PartFetcher(streamer, file_properties, ticket))
+            fetchers[-1].acquire()
+            if state:
+                state.on_slow.append(fetchers[-1].release)
+
+        async for chunk in yield_parts(fetchers, STREAM_READ_AHEAD * len(fetchers), parts, state):
+            yield chunk
+    finally:
+        for fetcher in fetchers:
+            fetcher.release()
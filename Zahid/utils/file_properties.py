@@ -1,3 +1,4 @@
+from datetime import datetime
 from pyrogram import Client
 from typing import Any, Optional
 from pyrogram.types import Message
@@ -16,18 +17,54 @@ async def parse_file_unique_id(message: "Messages") -> Optional[str]:
     if media:
         return media.file_unique_id
 
-async def get_file_ids(client: Client, chat_id: int, id: int) -> Optional[FileId]:
+class FileProperties:
+    """The properties of the media of a DB_CHANNEL message needed for streaming it."""
+    __slots__ = ("file_id", "message_id", "file_size", "mime_type", "file_name", "unique_id", "date")
+
+    def __init__(
+        self,
+        file_id: FileId,
+        message_id: int,
+        file_size: int,
+        mime_type: str,
+        file_name: str,
+        unique_id: str,
+        date: Optional[datetime] = None,
+    ):
+        self.file_id = file_id
+        self.message_id = message_id
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.file_name = file_name
+        self.unique_id = unique_id
+        self.date = date
+
+    @property
+    def dc_id(self) -> Optional[int]:
+        return self.file_id.dc_id if self.file_id else None
+
+
+async def get_file_ids(client: Client, chat_id: int, id: int) -> Optional[FileProperties]:
     message = await client.get_messages(chat_id, id)
     if message.empty:
         raise FIleNotFound
+    return get_message_properties(message)
+
+
+def get_message_properties(message: Message) -> Optional[FileProperties]:
     media = get_media_from_message(message)
-    file_unique_id = await parse_file_unique_id(message)
-    file_id = await parse_file_id(message)
-    setattr(file_id, "file_size", getattr(media, "file_size", 0))
-    setattr(file_id, "mime_type", getattr(media, "mime_type", ""))
-    setattr(file_id, "file_name", getattr(media, "file_name", ""))
-    setattr(file_id, "unique_id", file_unique_id)
-    return file_id
+    if not media or not getattr(media, "file_id", None):
+        return None
+    return FileProperties(
+        file_id=FileId.decode(media.file_id),
+        message_id=message.id,
+        file_size=getattr(media, "file_size", 0),
+        mime_type=getattr(media, "mime_type", ""),
+        file_name=getattr(media, "file_name", ""),
+        unique_id=getattr(media, "file_unique_id", ""),
+        date=message.date,
+    )
+
 
 def get_media_from_message(message: "Message") -> Any:
     media_types = (
@@ -0,0 +1,86 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import List, Set
+from pyrogram import Client
+from pyrogram.file_id import FileId
+from pyrogram.types import Message
+from plugins.database import get_stream_files, save_stream_file
+from config import DB_CHANNEL, FILE_STORE
+from .file_properties import FileProperties, get_message_properties
+
+
+def get_bot_id(client: Client) -> int:
+    """
+    Returns the ID of a bot client. File IDs are only valid for the bot that received them.
+    """
+    return int(client.bot_token.split(":")[0])
+
+
+class FileStore:
+    def __init__(self, enabled: bool = True):
+        """Keeps the FileProperties of DB_CHANNEL messages in Mongo, so that they outlive restarts.
+        attributes:
+            enabled: whether properties are saved and loaded at all.
+            pending: writes in flight, referenced until they finish.
+
+        functions:
+            save: stores the properties a client resolved, in the background.
+            remember: stores the properties of a message a bot just received or linked.
+            load: returns the most recently stored properties of a client.
+        """
+        self.enabled = enabled
+        self.pending: Set[asyncio.Task] = set()
+
+    def save(self, client: Client, file_properties: FileProperties) -> None:
+        if not self.enabled or not file_properties.file_id:
+            return
+        task = asyncio.create_task(self.write(get_bot_id(client), file_properties))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    def remember(self, client: Client, message: Message) -> None:
+        if not message.chat or message.chat.id != DB_CHANNEL:
+            return
+        file_properties = get_message_properties(message)
+        if file_properties:
+            self.save(client, file_properties)
+
+    @staticmethod
+    async def write(bot_id: int, file_properties: FileProperties) -> None:
+        date = file_properties.date
+        try:
+            await save_stream_file(
+                bot_id,
+                file_properties.message_id,
+                file_id=file_properties.file_id.encode(),
+                file_size=file_properties.file_size,
+                mime_type=file_properties.mime_type,
+                file_name=file_properties.file_name,
+                unique_id=file_properties.unique_id,
+                date=int(date.timestamp()) if date else None,
+                updated=int(time.time()),
+            )
+        except Exception:
+            logging.warning(f"Could not store properties of message with ID {file_properties.message_id}", exc_info=True)
+
+    async def load(self, client: Client, limit: int) -> List[FileProperties]:
+        if not self.enabled or limit <= 0:
+            return []
+        stored = await get_stream_files(get_bot_id(client), limit)
+        return [
+            FileProperties(
+                file_id=FileId.decode(entry.file_id),
+                message_id=entry.message_id,
+                file_size=entry.file_size,
+                mime_type=entry.mime_type,
+                file_name=entry.file_name,
+                unique_id=entry.unique_id,
+                date=datetime.fromtimestamp(entry.date, timezone.utc) if entry.date else None,
+            )
+            for entry in stored
+        ]
+
+
+file_store = FileStore(FILE_STORE)
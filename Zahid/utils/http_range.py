@@ -0,0 +1,106 @@
+import re
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator, List, Optional, Tuple
+
+# more ranges than this in one request are ignored and the whole file is served
+MAX_RANGES = 16
+RANGE_SPEC = re.compile(r"^(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    message = "Range not satisfiable"
+
+
+def parse_range(header: Optional[str], file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parses an RFC 7233 Range header into inclusive (first, last) byte ranges.
+    Supports open ranges (500-), suffix ranges (-500) and lists of ranges; overlapping
+    or adjacent ranges are merged. Returns None when the header is absent or malformed,
+    in which case the whole file is served. Raises RangeNotSatisfiable when none of the
+    ranges overlaps the file.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        match = RANGE_SPEC.match(spec.strip())
+        if not match or match.group(1) == match.group(2) == "":
+            return None
+        first, last = match.groups()
+        if first == "":
+            suffix = int(last)
+            if suffix == 0 or file_size == 0:
+                continue
+            ranges.append((max(0, file_size - suffix), file_size - 1))
+            continue
+        first = int(first)
+        if last and int(last) < first:
+            return None
+        if first >= file_size:
+            continue
+        last = min(int(last), file_size - 1) if last else file_size - 1
+        ranges.append((first, last))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for first, last in ranges[1:]:
+        if first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def multipart_headers(ranges: List[Tuple[int, int]], file_size: int, mime_type: str, boundary: str) -> List[bytes]:
+    """
+    Returns the delimiter and part headers written before each range of a multipart/byteranges body.
+    """
+    return [
+        (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {mime_type}\r\n"
+            f"Content-Range: bytes {first}-{last}/{file_size}\r\n\r\n"
+        ).encode()
+        for first, last in ranges
+    ]
+
+
+def multipart_length(ranges: List[Tuple[int, int]], headers: List[bytes], boundary: str) -> int:
+    return (
+        sum(last - first + 1 for first, last in ranges)
+        + sum(len(header) for header in headers)
+        + len(f"\r\n--{boundary}--\r\n")
+    )
+
+
+async def multipart_body(
+    chunks: AsyncGenerator[bytes, None],
+    ranges: List[Tuple[int, int]],
+    headers: List[bytes],
+    boundary: str,
+) -> AsyncIterator[bytes]:
+    """
+    Wraps the bytes of all ranges, fetched in one pass, into a multipart/byteranges body.
+    Chunks never span two ranges, since every range is planned into its own parts.
+    """
+    remaining = 0
+    current = -1
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            if remaining == 0:
+                current += 1
+                first, last = ranges[current]
+                remaining = last - first + 1
+                yield headers[current]
+            remaining -= len(chunk)
+            yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
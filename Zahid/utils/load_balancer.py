@@ -0,0 +1,123 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional
+from Zahid.bot import multi_clients, work_loads
+from config import AFFINITY_SLACK, LOAD_BALANCER
+from .client_health import client_health
+
+# weight of the newest sample in the moving averages
+EWMA_ALPHA = 0.2
+# latency assumed for a client that has not served a chunk yet, in seconds
+DEFAULT_LATENCY = 0.5
+
+
+class ClientStats:
+    """Moving averages of how a client performed on recent chunk requests."""
+    __slots__ = ("latency", "error_rate", "requests", "errors")
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+
+
+class LoadBalancer:
+    def __init__(self, strategy: str = "latency", affinity_slack: int = 2):
+        """Ranks the clients that may serve a request.
+        attributes:
+            strategy: the name of the scoring function in STRATEGIES.
+            affinity_slack: extra streams a client on the file's DC may carry and still be preferred.
+            stats: per client latency and error rate, keyed by client index.
+
+        functions:
+            record: feeds the outcome of a chunk request into the client's stats.
+            rank: returns the available client indexes ordered from best to worst.
+        """
+        if strategy not in self.STRATEGIES:
+            logging.warning(f"Unknown load balancer {strategy}, using least_loaded")
+            strategy = "least_loaded"
+        self.strategy = strategy
+        self.affinity_slack = affinity_slack
+        self.stats: Dict[int, ClientStats] = {}
+
+    def record(self, index: int, latency: Optional[float] = None, error: bool = False) -> None:
+        stats = self.stats.setdefault(index, ClientStats())
+        stats.requests += 1
+        if error:
+            stats.errors += 1
+        stats.error_rate += EWMA_ALPHA * (float(error) - stats.error_rate)
+        if latency is not None:
+            if stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency += EWMA_ALPHA * (latency - stats.latency)
+
+    @staticmethod
+    def client_dcs(index: int) -> List[int]:
+        """
+        Returns the DCs a client can fetch from without a new authorization: its home DC
+        and the DCs it already holds media sessions for.
+        """
+        client = multi_clients.get(index)
+        dcs = set(getattr(client, "media_sessions", {}) or {})
+        home_dc = getattr(getattr(client, "session", None), "dc_id", None)
+        if home_dc:
+            dcs.add(home_dc)
+        return sorted(dcs)
+
+    def least_loaded(self, index: int, dc_id: Optional[int]) -> float:
+        return work_loads[index]
+
+    def latency(self, index: int, dc_id: Optional[int]) -> float:
+        """
+        Expected time for the client to serve one more stream: its EWMA chunk latency
+        scaled by the streams it already serves and by its recent error rate.
+        """
+        stats = self.stats.get(index)
+        latency = stats.latency if stats and stats.latency is not None else DEFAULT_LATENCY
+        error_rate = stats.error_rate if stats else 0.0
+        return latency * (work_loads[index] + 1) * (1 + 4 * error_rate)
+
+    STRATEGIES: Dict[str, Callable[["LoadBalancer", int, Optional[int]], float]] = {
+        "least_loaded": least_loaded,
+        "latency": latency,
+    }
+
+    def rank(self, dc_id: Optional[int] = None) -> List[int]:
+        """
+        Orders the available clients by score. When the file's DC is known, clients that
+        reach it without a new session come first, as long as they carry at most
+        affinity_slack more streams than the least loaded client.
+        """
+        score = self.STRATEGIES[self.strategy]
+        available = [index for index in work_loads if client_health.available(index)]
+        ranked = sorted(available, key=lambda index: score(self, index, dc_id))
+        if dc_id is None or self.affinity_slack < 0 or not ranked:
+            return ranked
+        limit = min(work_loads[index] for index in ranked) + self.affinity_slack
+        preferred = [
+            index for index in ranked
+            if work_loads[index] <= limit and dc_id in self.client_dcs(index)
+        ]
+        return preferred + [index for index in ranked if index not in preferred]
+
+    def describe(self) -> Dict[str, Any]:
+        """
+        Returns the inputs of the balancing decision for the status route.
+        """
+        clients = {}
+        for index in sorted(work_loads):
+            stats = self.stats.get(index, ClientStats())
+            clients["bot" + str(index + 1)] = {
+                "load": work_loads[index],
+                "latency_ms": round(stats.latency * 1000) if stats.latency is not None else None,
+                "error_rate": round(stats.error_rate, 3),
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "dcs": self.client_dcs(index),
+                **client_health.describe(index),
+            }
+        return {"strategy": self.strategy, "affinity_slack": self.affinity_slack, "clients": clients}
+
+
+balancer = LoadBalancer(LOAD_BALANCER, AFFINITY_SLACK)
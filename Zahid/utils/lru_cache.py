@@ -0,0 +1,73 @@
+import time
+from typing import Any, Dict, Hashable, Optional
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, max_entries: int, ttl: float):
+        """An LRU cache with a maximum entry count and a per entry time to live.
+        attributes:
+            max_entries: the maximum number of entries kept, least recently used are evicted first.
+            ttl: seconds after which an entry expires, 0 keeps entries until they are evicted.
+            entries: the cached values with their expiry time, least recently used first.
+            hits, misses, evictions: counters for tuning the cache size.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and not self._expired(entry)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None or self._expired(entry):
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns a live entry without touching its recency or the hit counters.
+        """
+        entry = self.entries.get(key)
+        if entry is None or self._expired(entry):
+            return None
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self.entries[key] = (value, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+    @staticmethod
+    def _expired(entry: tuple) -> bool:
+        return entry[1] is not None and entry[1] < time.monotonic()
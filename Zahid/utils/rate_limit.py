@@ -0,0 +1,222 @@
+import time
+import asyncio
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, Hashable, List, Optional, Tuple, Union
+from aiohttp import web
+from Zahid.server.exceptions import RateLimited
+from config import (
+    BANDWIDTH_BURST,
+    IP_BANDWIDTH,
+    IP_MAX_STREAMS,
+    LINK_BANDWIDTH,
+    LINK_MAX_STREAMS,
+    REAL_IP_HEADER,
+)
+from .chunk_planner import part_view
+
+# bytes a shaped stream writes at once, small enough for the pace to stay smooth
+SLICE_SIZE = 64 * 1024
+# seconds a client refused for too many streams is asked to wait
+RETRY_AFTER = 5
+
+
+class TokenBucket:
+    """Bandwidth in bytes, refilled at rate up to capacity. Taking more than is left runs a debt that is waited out."""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: int, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, amount: int) -> float:
+        """
+        Takes amount bytes and returns the seconds to wait before sending them.
+        """
+        self.tokens = self.refill() - amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Usage:
+    """The open streams and bandwidth bucket of one IP or one file."""
+    __slots__ = ("streams", "bucket")
+
+    def __init__(self, bucket: Optional[TokenBucket]):
+        self.streams = 0
+        self.bucket = bucket
+
+
+class Limit:
+    def __init__(self, scope: str, max_streams: int, bandwidth: int, burst: int):
+        """Caps the open streams of every key of one scope and shares a bandwidth budget among them.
+        attributes:
+            scope: what the keys are, ip or link.
+            max_streams: streams a key may have open at once, 0 for no limit.
+            bandwidth: bytes per second shared by the streams of a key, 0 for no limit.
+            burst: seconds of bandwidth a key may send at full speed after idling.
+            usage: the open streams and bucket of every key in use.
+            refused: requests refused for having too many streams open.
+
+        functions:
+            acquire: opens a stream for a key, raising RateLimited when it has max_streams open.
+            release: closes it, forgetting the key once it is idle and its bucket has refilled.
+        """
+        self.scope = scope
+        self.max_streams = max_streams
+        self.bandwidth = bandwidth
+        self.burst = max(1, burst)
+        self.usage: Dict[Hashable, Usage] = {}
+        self.refused = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_streams or self.bandwidth)
+
+    def acquire(self, key: Hashable) -> Usage:
+        usage = self.usage.get(key)
+        if usage is None:
+            bucket = TokenBucket(self.bandwidth, self.bandwidth * self.burst) if self.bandwidth else None
+            usage = self.usage[key] = Usage(bucket)
+        if self.max_streams and usage.streams >= self.max_streams:
+            self.refused += 1
+            raise RateLimited(f"{self.scope};streams={self.max_streams}", RETRY_AFTER)
+        usage.streams += 1
+        return usage
+
+    def release(self, key: Hashable, usage: Usage) -> None:
+        usage.streams -= 1
+        if not usage.streams:
+            asyncio.get_running_loop().call_later(self.burst, self.forget, key)
+
+    def forget(self, key: Hashable) -> None:
+        usage = self.usage.get(key)
+        if usage is None or usage.streams:
+            return
+        if usage.bucket and usage.bucket.refill() < usage.bucket.capacity:
+            asyncio.get_running_loop().call_later(self.burst, self.forget, key)
+            return
+        del self.usage[key]
+
+    def describe(self, usage: Usage) -> str:
+        """
+        Returns the limits of the scope as reported in the X-Stream-Limit header.
+        """
+        limit = self.scope
+        if self.max_streams:
+            limit += f";streams={self.max_streams};open={usage.streams}"
+        if self.bandwidth:
+            limit += f";bandwidth={self.bandwidth}"
+        return limit
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_streams": self.max_streams or None,
+            "bandwidth_kib": self.bandwidth // 1024 or None,
+            "keys": len(self.usage),
+            "open": sum(usage.streams for usage in self.usage.values()),
+            "refused": self.refused,
+        }
+
+
+class Grant:
+    """The limits one stream holds, from the request until the response is written."""
+    __slots__ = ("held", "released")
+
+    def __init__(self, held: List[Tuple[Limit, Hashable, Usage]]):
+        self.held = held
+        self.released = False
+
+    @property
+    def shaped(self) -> bool:
+        return any(usage.bucket for _, _, usage in self.held)
+
+    async def pace(self, size: int) -> float:
+        """
+        Takes size bytes from every bucket of the stream and waits until the slowest
+        one allows them. Returns the seconds waited.
+        """
+        delay = max((usage.bucket.take(size) for _, _, usage in self.held if usage.bucket), default=0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def headers(self) -> Dict[str, str]:
+        if not self.held:
+            return {}
+        return {"X-Stream-Limit": ", ".join(limit.describe(usage) for limit, _, usage in self.held)}
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            for limit, key, usage in self.held:
+                limit.release(key, usage)
+
+
+class StreamLimits:
+    def __init__(self, limits: List[Limit]):
+        """Applies the per IP and per file limits to the streams of the server.
+        attributes:
+            limits: the ip and link limits, only the enabled ones are applied.
+
+        functions:
+            acquire: returns the Grant of a new stream, raising RateLimited with the limit it hit.
+        """
+        self.limits = {limit.scope: limit for limit in limits}
+
+    def acquire(self, request: web.Request, id: int) -> Grant:
+        keys = {"ip": client_ip(request), "link": id}
+        grant = Grant([])
+        try:
+            for scope, limit in self.limits.items():
+                if limit.enabled:
+                    grant.held.append((limit, keys[scope], limit.acquire(keys[scope])))
+        except RateLimited:
+            grant.release()
+            raise
+        return grant
+
+    def stats(self) -> Dict[str, Any]:
+        return {scope: limit.stats() for scope, limit in self.limits.items() if limit.enabled}
+
+
+def client_ip(request: web.Request) -> Optional[str]:
+    """
+    Returns the IP of the client, read from REAL_IP_HEADER when the server runs behind
+    a reverse proxy. Only the last entry is used, the one the proxy itself appended.
+    """
+    if REAL_IP_HEADER:
+        forwarded = request.headers.get(REAL_IP_HEADER)
+        if forwarded:
+            return forwarded.rsplit(",", 1)[-1].strip()
+    return request.remote
+
+
+async def shape(
+    body: AsyncIterator[Union[bytes, memoryview]],
+    grant: Grant,
+) -> AsyncIterator[Union[bytes, memoryview]]:
+    """
+    Paces the body to the bandwidth of the grant in SLICE_SIZE pieces. The writer does
+    not count time spent waiting on the body, so shaping never makes a stream look slow.
+    """
+    async with aclosing(body) as chunks:
+        async for chunk in chunks:
+            for start in range(0, len(chunk), SLICE_SIZE):
+                piece = part_view(chunk, start, start + SLICE_SIZE)
+                await grant.pace(len(piece))
+                yield piece
+
+
+stream_limits = StreamLimits(
+    [
+        Limit("ip", IP_MAX_STREAMS, IP_BANDWIDTH * 1024, BANDWIDTH_BURST),
+        Limit("link", LINK_MAX_STREAMS, LINK_BANDWIDTH * 1024, BANDWIDTH_BURST),
+    ]
+)
@@ -17,10 +17,11 @@ async def render_page(id, secure_hash, src=None):
         logging.debug(f"Invalid hash for message with - ID {id}")
         raise InvalidHash
 
-    src = urllib.parse.urljoin(
-        URL,
-        f"{id}/{urllib.parse.quote_plus(file_data.file_name)}?hash={secure_hash}",
-    )
+    if src is None:
+        src = urllib.parse.urljoin(
+            URL,
+            f"{id}/{urllib.parse.quote_plus(file_data.file_name)}?hash={secure_hash}",
+        )
 
     tag = file_data.mime_type.split("/")[0].strip()
     file_size = humanbytes(file_data.file_size)
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from pyrogram import Client
+from Zahid.bot import multi_clients
+from config import PREWARM_SESSIONS, SESSION_KEEPALIVE, WARMUP_CONCURRENCY
+from .custom_dl import class_cache, get_streamer
+
+# the DCs of Telegram's production network
+PRODUCTION_DCS = (1, 2, 3, 4, 5)
+
+
+async def prewarm_client(index: int, client: Client, semaphore: asyncio.Semaphore) -> None:
+    """
+    Opens a media session to every production DC the client has none for yet.
+    """
+    streamer = get_streamer(index)
+    for dc_id in PRODUCTION_DCS:
+        if streamer.media_sessions.get(dc_id):
+            continue
+        try:
+            async with semaphore:
+                await streamer.get_media_session(client, dc_id)
+            logging.debug(f"Pre-warmed media session for DC {dc_id} of client {index}")
+        except Exception:
+            logging.warning(f"Could not pre-warm media session for DC {dc_id} of client {index}", exc_info=True)
+
+
+async def prewarm_media_sessions() -> None:
+    """
+    Opens media sessions to all production DCs for every client, so that no request
+    waits on the authorization export and import of a DC it has not used yet.
+    """
+    semaphore = asyncio.Semaphore(max(1, WARMUP_CONCURRENCY))
+    await asyncio.gather(
+        *[prewarm_client(index, client, semaphore) for index, client in list(multi_clients.items())]
+    )
+
+
+async def keep_media_sessions() -> None:
+    """
+    Every SESSION_KEEPALIVE seconds, closes idle extra media sessions and pings the ones
+    kept. With PREWARM_SESSIONS, a DC whose session was dropped is opened again right away.
+    """
+    if PREWARM_SESSIONS:
+        await prewarm_media_sessions()
+        logging.info("Pre-warmed media sessions for all DCs")
+    while True:
+        await asyncio.sleep(SESSION_KEEPALIVE)
+        for streamer in list(class_cache.values()):
+            try:
+                await streamer.check_media_sessions()
+            except Exception:
+                logging.warning(f"Checking media sessions of client {streamer.index} failed", exc_info=True)
+        if PREWARM_SESSIONS:
+            await prewarm_media_sessions()
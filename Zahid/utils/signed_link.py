@@ -0,0 +1,92 @@
+import hmac
+import json
+import time
+import base64
+import hashlib
+from datetime import datetime, timezone
+from typing import Tuple
+from urllib.parse import quote_plus
+from pyrogram.types import Message
+from Zahid.server.exceptions import InvalidHash, LinkExpired
+from .file_properties import FileProperties, get_message_properties
+from config import SIGNED_LINKS, SIGNED_LINK_EXPIRY, STREAM_SECRET, URL
+
+# bytes of the HMAC-SHA256 digest kept in a link
+SIGNATURE_SIZE = 16
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def sign(payload: str) -> str:
+    digest = hmac.new(STREAM_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+    return b64encode(digest[:SIGNATURE_SIZE])
+
+
+def make_token(file_properties: FileProperties, expiry: int = SIGNED_LINK_EXPIRY) -> str:
+    """
+    Returns a signed token describing a media file: message ID, size, mime type, file name,
+    unique ID, message date and the time the link expires at.
+    """
+    date = file_properties.date
+    payload = b64encode(
+        json.dumps(
+            {
+                "i": file_properties.message_id,
+                "s": file_properties.file_size,
+                "m": file_properties.mime_type or "",
+                "n": file_properties.file_name or "",
+                "u": file_properties.unique_id,
+                "d": int(date.timestamp()) if date else 0,
+                "e": int(time.time()) + expiry if expiry else 0,
+            },
+            separators=(",", ":"),
+            ensure_ascii=False,
+        ).encode()
+    )
+    return f"{payload}.{sign(payload)}"
+
+
+def read_token(token: str) -> FileProperties:
+    """
+    Verifies a signed token and returns the file properties it carries, without a file ID.
+    Raises InvalidHash for a token that was not signed with STREAM_SECRET and LinkExpired
+    once its expiry has passed.
+    """
+    payload, _, signature = token.partition(".")
+    if not hmac.compare_digest(sign(payload), signature):
+        raise InvalidHash
+    try:
+        data = json.loads(b64decode(payload))
+    except ValueError:
+        raise InvalidHash
+    if data["e"] and data["e"] < time.time():
+        raise LinkExpired
+    return FileProperties(
+        file_id=None,
+        message_id=data["i"],
+        file_size=data["s"],
+        mime_type=data["m"],
+        file_name=data["n"],
+        unique_id=data["u"],
+        date=datetime.fromtimestamp(data["d"], timezone.utc) if data["d"] else None,
+    )
+
+
+def get_stream_links(media_msg: Message) -> Tuple[str, str]:
+    """
+    Returns the watch and download links of a DB_CHANNEL message, signed when SIGNED_LINKS is on.
+    """
+    file_properties = get_message_properties(media_msg)
+    file_name = quote_plus(file_properties.file_name or "")
+    if SIGNED_LINKS:
+        path = f"s/{make_token(file_properties)}/{file_name}"
+    else:
+        path = f"{media_msg.id}/{file_name}?hash={file_properties.unique_id[:6]}"
+    return f"{URL}watch/{path}", f"{URL}{path}"
+
@@ -0,0 +1,161 @@
+import time
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Union
+from aiohttp import web
+from config import SLOW_CLIENT_GRACE, SLOW_CLIENT_POLICY, SLOW_CLIENT_RATE
+
+OFF = "off"
+DEPRIORITIZE = "deprioritize"
+DISCONNECT = "disconnect"
+
+
+class StreamState:
+    """The throughput of one streaming response, shared with the generator that feeds it."""
+    __slots__ = ("remote", "started", "bytes_sent", "checkpoint", "checkpoint_bytes", "paused", "rate", "slow", "on_slow")
+
+    def __init__(self, remote: Optional[str] = None):
+        self.remote = remote
+        self.started = time.monotonic()
+        self.bytes_sent = 0
+        self.checkpoint = self.started
+        self.checkpoint_bytes = 0
+        self.paused = 0.0
+        self.rate: Optional[float] = None
+        self.slow = False
+        self.on_slow: List[Callable[[], None]] = []
+
+    def mark_slow(self) -> None:
+        """
+        Marks the stream slow and runs the callbacks of the generators feeding it.
+        """
+        self.slow = True
+        for callback in self.on_slow:
+            callback()
+
+    def record(self, sent: int) -> None:
+        """
+        Counts bytes the client accepted, and updates the rate once per SLOW_CLIENT_GRACE seconds.
+        Time the stream spent waiting for its body, on Telegram or on bandwidth shaping,
+        does not count against the client, only time spent writing does.
+        """
+        self.bytes_sent += sent
+        now = time.monotonic()
+        elapsed = now - self.checkpoint
+        if elapsed >= SLOW_CLIENT_GRACE:
+            self.rate = (self.bytes_sent - self.checkpoint_bytes) / max(elapsed - self.paused, 0.001)
+            self.checkpoint, self.checkpoint_bytes, self.paused = now, self.bytes_sent, 0.0
+
+
+class StreamWriter:
+    def __init__(self, policy: str, min_rate: int, grace: float):
+        """Writes streaming responses with backpressure and handles clients that read too slowly.
+        attributes:
+            policy: what happens to a slow client, off, deprioritize or disconnect.
+            min_rate: the throughput in bytes per second under which a client is slow.
+            grace: seconds over which throughput is measured, and the longest a single write may stall.
+            active: the states of the responses being written.
+
+        A deprioritized stream keeps a single part in flight and gives up its work load
+        slot, so it no longer counts against its client. A disconnected one is closed.
+        """
+        if policy not in (OFF, DEPRIORITIZE, DISCONNECT):
+            logging.warning(f"Unknown slow client policy {policy}, using {DEPRIORITIZE}")
+            policy = DEPRIORITIZE
+        self.policy = policy
+        self.min_rate = min_rate
+        self.grace = grace
+        self.active: Set[StreamState] = set()
+
+    async def write(
+        self,
+        request: web.Request,
+        response: web.StreamResponse,
+        body: AsyncIterator[Union[bytes, memoryview]],
+        state: StreamState,
+    ) -> web.StreamResponse:
+        """
+        Sends the body chunk by chunk, waiting for each write to drain before pulling
+        the next chunk, so a client is never more than one chunk behind its reads.
+        A body that fails once the headers are out aborts the connection, so the
+        client sees a failed transfer rather than a short or corrupted one.
+        """
+        await response.prepare(request)
+        self.active.add(state)
+        try:
+            async with aclosing(body) as chunks:
+                waiting = time.monotonic()
+                async for chunk in chunks:
+                    state.paused += time.monotonic() - waiting
+                    write = asyncio.ensure_future(response.write(chunk))
+                    try:
+                        done, _ = await asyncio.wait({write}, timeout=self.grace)
+                        if not done and self.is_slow(state, stalled=True):
+                            if self.policy == DISCONNECT:
+                                return self.disconnect(request, response, state)
+                        await write
+                    finally:
+                        # the handler is cancelled when the client goes away, never leave the write behind
+                        if not write.done():
+                            write.cancel()
+                        elif not write.cancelled():
+                            write.exception()
+                    state.record(len(chunk))
+                    if self.is_slow(state) and self.policy == DISCONNECT:
+                        return self.disconnect(request, response, state)
+                    waiting = time.monotonic()
+            await response.write_eof()
+        except Exception as e:
+            log_failed_stream(state.remote, state.bytes_sent, e)
+            self.abort(request, response)
+        finally:
+            self.active.discard(state)
+        return response
+
+    def is_slow(self, state: StreamState, stalled: bool = False) -> bool:
+        """
+        Marks and returns whether a stream reads slower than min_rate.
+        """
+        if self.policy == OFF or state.slow:
+            return state.slow
+        if stalled or (state.rate is not None and state.rate < self.min_rate):
+            rate = f"{state.rate / 1024:.1f} KiB/s" if state.rate is not None else "a stalled write"
+            logging.info(f"Client {state.remote} is reading slowly ({rate}), applying {self.policy}")
+            state.mark_slow()
+        return state.slow
+
+    @classmethod
+    def disconnect(cls, request: web.Request, response: web.StreamResponse, state: StreamState) -> web.StreamResponse:
+        logging.info(f"Disconnecting slow client {state.remote} after {state.bytes_sent} bytes")
+        return cls.abort(request, response)
+
+    @staticmethod
+    def abort(request: web.Request, response: web.StreamResponse) -> web.StreamResponse:
+        """
+        Drops the connection of a prepared response without flushing it. Nothing else
+        may be written to it, not even an error response.
+        """
+        if request.transport is not None:
+            request.transport.abort()
+        response.force_close()
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        rates = [state.rate for state in self.active if state.rate is not None]
+        return {
+            "policy": self.policy,
+            "active": len(self.active),
+            "slow": sum(state.slow for state in self.active),
+            "throughput_kib": round(sum(rates) / 1024),
+        }
+
+
+def log_failed_stream(remote: Optional[str], sent: int, error: Exception) -> None:
+    if isinstance(error, ConnectionError):
+        logging.debug(f"Client {remote} went away after {sent} bytes")
+    else:
+        logging.warning(f"Stream to {remote} failed after {sent} bytes, aborting it: {error!r}")
+
+
+stream_writer = StreamWriter(SLOW_CLIENT_POLICY, SLOW_CLIENT_RATE * 1024, SLOW_CLIENT_GRACE)
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from pyrogram import Client
+from pyrogram.file_id import FileId
+from Zahid.bot import multi_clients, StreamBot
+from plugins.database import get_latest_stream_message_id
+from config import DB_CHANNEL, WARMUP_CONCURRENCY, WARMUP_MESSAGES
+from .custom_dl import get_streamer
+from .file_properties import get_message_properties
+
+# message IDs per get_messages call, the most Telegram accepts
+BATCH_SIZE = 200
+
+
+async def find_latest_message_id(semaphore: asyncio.Semaphore) -> Optional[int]:
+    """
+    Returns the ID of the newest message in DB_CHANNEL. Bots cannot read a channel's
+    history, so the search starts at the newest stored message and reads batches
+    forward until one comes back empty.
+    """
+    latest = await get_latest_stream_message_id()
+    if latest is None:
+        return None
+    while True:
+        async with semaphore:
+            messages = await StreamBot.get_messages(DB_CHANNEL, list(range(latest + 1, latest + BATCH_SIZE + 1)))
+        found = [message.id for message in messages if not message.empty]
+        if not found:
+            return latest
+        latest = max(found)
+
+
+async def warm_client(index: int, client: Client, message_ids: List[int], semaphore: asyncio.Semaphore) -> None:
+    """
+    Caches the file properties of the given messages for one client and starts its
+    media sessions for the DCs the files live on.
+    """
+    streamer = get_streamer(index)
+    dcs: Dict[int, FileId] = {}
+    cached = 0
+    for start in range(0, len(message_ids), BATCH_SIZE):
+        batch = message_ids[start:start + BATCH_SIZE]
+        try:
+            async with semaphore:
+                messages = await client.get_messages(DB_CHANNEL, batch)
+        except Exception:
+            logging.warning(f"Warm-up of client {index} could not read messages {batch[0]}-{batch[-1]}", exc_info=True)
+            continue
+        for message in messages:
+            file_properties = None if message.empty else get_message_properties(message)
+            if file_properties:
+                streamer.cached_file_ids.set(message.id, file_properties)
+                dcs.setdefault(file_properties.dc_id, file_properties.file_id)
+                cached += 1
+
+    for dc_id, file_id in dcs.items():
+        try:
+            async with semaphore:
+                await streamer.generate_media_session(client, file_id)
+        except Exception:
+            logging.warning(f"Warm-up of client {index} could not create a media session for DC {dc_id}", exc_info=True)
+    logging.info(f"Warmed up client {index} with {cached} files on DCs {sorted(dcs)}")
+
+
+async def warm_up() -> None:
+    """
+    Fills the caches of every client from the latest WARMUP_MESSAGES messages of DB_CHANNEL,
+    running at most WARMUP_CONCURRENCY requests to Telegram at a time.
+    """
+    if WARMUP_MESSAGES <= 0:
+        return
+    semaphore = asyncio.Semaphore(max(1, WARMUP_CONCURRENCY))
+    try:
+        latest = await find_latest_message_id(semaphore)
+    except Exception:
+        logging.warning("Warm-up could not find the latest DB_CHANNEL message", exc_info=True)
+        return
+    if latest is None:
+        logging.info("Skipping warm-up, no DB_CHANNEL message is known yet")
+        return
+    message_ids = list(range(max(1, latest - WARMUP_MESSAGES + 1), latest + 1))
+    await asyncio.gather(
+        *[warm_client(index, client, message_ids, semaphore) for index, client in list(multi_clients.items())]
+    )
@@ -0,0 +1,65 @@
+"""
+Measures the memory allocated while streaming ranges out of the hot cache.
+
+Streams RANGES concurrent random byte ranges of a FILE_SIZE file whose blocks are all
+in the hot cache, and prints the peak memory traced by tracemalloc. No Telegram
+connection is made, so placeholder credentials are enough:
+
+    python benchmarks/stream_alloc.py
+
+Run it before and after a change to the streaming path to compare the peaks.
+"""
+import os
+import sys
+import random
+import asyncio
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for key, value in (("API_ID", "1"), ("API_HASH", "x"), ("BOT_TOKEN", "1:x"), ("DB_URI", "mongodb://localhost:1")):
+    os.environ.setdefault(key, value)
+os.environ.setdefault("HOT_CACHE_SIZE", "64")
+
+import Zahid.server  # the stream routes load the streaming modules, as in bot.py
+from Zahid.utils.chunk_cache import hot_cache
+from Zahid.utils.chunk_planner import CHUNK_SIZE, plan_parts
+from Zahid.utils.custom_dl import ByteStreamer, yield_parts
+from Zahid.utils.file_properties import FileProperties
+
+FILE_SIZE = 8 * CHUNK_SIZE
+RANGES = 400
+SEED = 1
+
+
+async def stream(fetch, first: int, last: int) -> int:
+    sent = 0
+    async for chunk in yield_parts([fetch], 4, plan_parts(first, last, FILE_SIZE)):
+        sent += len(chunk)
+    return sent
+
+
+async def main() -> None:
+    block = os.urandom(CHUNK_SIZE)
+    for index in range(FILE_SIZE // CHUNK_SIZE):
+        hot_cache.put(1, index, block)
+    streamer = ByteStreamer(None, 0)
+    file_properties = FileProperties(None, 1, FILE_SIZE, "video/mp4", "benchmark.mp4", "BENCHMARK")
+
+    async def fetch(offset: int, limit: int):
+        return await streamer.get_chunk(file_properties, offset, limit)
+
+    random.seed(SEED)
+    ranges = []
+    for _ in range(RANGES):
+        first = random.randrange(FILE_SIZE - 300000)
+        ranges.append((first, min(first + random.randrange(1, 2 * CHUNK_SIZE), FILE_SIZE - 1)))
+
+    tracemalloc.start()
+    sent = sum(await asyncio.gather(*[stream(fetch, first, last) for first, last in ranges]))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{RANGES} ranges, {sent / 1e6:.1f} MB streamed, traced peak {peak / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -28,6 +28,9 @@ from plugins.clone import restart_bots
 from Zahid.bot import StreamBot
 from Zahid.utils.keepalive import ping_server
 from Zahid.bot.clients import initialize_clients
+from Zahid.utils.custom_dl import load_file_properties
+from Zahid.utils.warm_up import warm_up
+from Zahid.utils.session_keeper import keep_media_sessions
 
 # Set up the bot automation 
 from plugins.Automation.Quotes import schedule_daily_quotes
@@ -56,6 +59,7 @@ async def start():
     bot_info = await StreamBot.get_me()
     StreamBot.username = bot_info.username
     await initialize_clients()
+    await load_file_properties()
 
     # Dynamic import for both plugin folders
     for name in all_files:
@@ -70,6 +74,12 @@ async def start():
             sys.modules[import_path] = load
             print("Tactition Imported =>", plugin_name)
 
+    # Warm the caches from the latest DB_CHANNEL files without delaying startup
+    asyncio.create_task(warm_up())
+
+    # Pre-warm media sessions when enabled and keep the open ones alive
+    asyncio.create_task(keep_media_sessions())
+
     # Start pinging server to keep the instance alive on all platforms!
     asyncio.create_task(ping_server())
 
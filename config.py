@@ -94,6 +94,46 @@ STREAM_MODE = bool(environ.get('STREAM_MODE', True)) # Set True or False
 MULTI_CLIENT = True
 SLEEP_THRESHOLD = int(environ.get('SLEEP_THRESHOLD', '00'))
 PING_INTERVAL = int(environ.get("PING_INTERVAL", "40")) # in Seconds 
+STREAM_READ_AHEAD = int(environ.get("STREAM_READ_AHEAD", "4")) # GetFile requests kept in flight per stream
+STREAM_BUFFER_LIMIT = int(environ.get("STREAM_BUFFER_LIMIT", "8")) # in MiB, buffered bytes allowed per stream
+STRIPED_STREAM = is_enabled((environ.get('STRIPED_STREAM', "False")), False) # Fetch one download through several clients
+STRIPE_CLIENTS = int(environ.get("STRIPE_CLIENTS", "4")) # Max clients used for one striped download
+CHUNK_CACHE_DIR = environ.get("CHUNK_CACHE_DIR", "chunk_cache") # Directory for cached media chunks
+CHUNK_CACHE_SIZE = int(environ.get("CHUNK_CACHE_SIZE", "0")) # in MiB, 0 disables the disk chunk cache
+HOT_CACHE_SIZE = int(environ.get("HOT_CACHE_SIZE", "32")) # in MiB, 0 disables the in-memory chunk cache
+WHOLE_BLOCK_READ = int(environ.get("WHOLE_BLOCK_READ", "128")) # in KiB, partial reads of a block this large fetch and cache the whole block, 0 never does
+FILE_CACHE_SIZE = int(environ.get("FILE_CACHE_SIZE", "2000")) # Max cached file properties per client
+FILE_CACHE_TTL = int(environ.get("FILE_CACHE_TTL", "21600")) # in Seconds, 0 keeps entries until evicted
+MEDIA_SESSION_POOL = int(environ.get("MEDIA_SESSION_POOL", "1")) # Media sessions kept per DC for each client
+LOAD_BALANCER = environ.get("LOAD_BALANCER", "latency") # latency or least_loaded
+AFFINITY_SLACK = int(environ.get("AFFINITY_SLACK", "2")) # Extra streams a client already on the file's DC may carry and still be preferred, -1 disables
+MAX_STREAMS_PER_CLIENT = int(environ.get("MAX_STREAMS_PER_CLIENT", "0")) # Streams a client serves at once, 0 for no limit
+STREAM_QUEUE_SIZE = int(environ.get("STREAM_QUEUE_SIZE", "100")) # Requests allowed to wait for a free stream slot
+STREAM_QUEUE_TIMEOUT = int(environ.get("STREAM_QUEUE_TIMEOUT", "15")) # in Seconds, longest wait for a free stream slot
+BREAKER_THRESHOLD = int(environ.get("BREAKER_THRESHOLD", "3")) # Consecutive failures before a client is quarantined
+BREAKER_COOLDOWN = int(environ.get("BREAKER_COOLDOWN", "60")) # in Seconds, quarantine of a broken client
+STREAM_RETRIES = int(environ.get("STREAM_RETRIES", "2")) # Retries of a failed part on the same client
+STREAM_RETRY_BACKOFF = float(environ.get("STREAM_RETRY_BACKOFF", "0.5")) # in Seconds, doubled on every retry
+STREAM_FAILOVERS = int(environ.get("STREAM_FAILOVERS", "2")) # Other clients tried for a part before giving up
+SLOW_CLIENT_POLICY = environ.get("SLOW_CLIENT_POLICY", "deprioritize") # off, deprioritize or disconnect
+SLOW_CLIENT_RATE = int(environ.get("SLOW_CLIENT_RATE", "32")) # in KiB/s, streams read slower than this are slow
+SLOW_CLIENT_GRACE = int(environ.get("SLOW_CLIENT_GRACE", "30")) # in Seconds, window over which stream throughput is measured
+IP_MAX_STREAMS = int(environ.get("IP_MAX_STREAMS", "0")) # Streams one IP may have open at once, 0 for no limit
+IP_BANDWIDTH = int(environ.get("IP_BANDWIDTH", "0")) # in KiB/s, shared by the streams of one IP, 0 for no limit
+LINK_MAX_STREAMS = int(environ.get("LINK_MAX_STREAMS", "0")) # Streams one file may have open at once, 0 for no limit
+LINK_BANDWIDTH = int(environ.get("LINK_BANDWIDTH", "0")) # in KiB/s, shared by the streams of one file, 0 for no limit
+BANDWIDTH_BURST = int(environ.get("BANDWIDTH_BURST", "2")) # in Seconds of bandwidth sent at full speed after idling
+REAL_IP_HEADER = environ.get("REAL_IP_HEADER", "") # Header the reverse proxy puts the client IP in, like X-Forwarded-For
+SIGNED_LINKS = is_enabled((environ.get('SIGNED_LINKS', "False")), False) # Emit signed, self-describing stream links
+STREAM_SECRET = environ.get("STREAM_SECRET", BOT_TOKEN) # HMAC key of signed links, changing it revokes all of them
+SIGNED_LINK_EXPIRY = int(environ.get("SIGNED_LINK_EXPIRY", "604800")) # in Seconds, 0 never expires
+FILE_STORE = is_enabled((environ.get('FILE_STORE', "True")), True) # Keep file properties in Mongo across restarts
+FILE_STORE_PRELOAD = int(environ.get("FILE_STORE_PRELOAD", "2000")) # Stored file properties loaded per client at startup
+WARMUP_MESSAGES = int(environ.get("WARMUP_MESSAGES", "0")) # Latest DB_CHANNEL messages cached at startup, 0 disables the warm-up
+WARMUP_CONCURRENCY = int(environ.get("WARMUP_CONCURRENCY", "2")) # Telegram requests the warm-up runs at once
+PREWARM_SESSIONS = is_enabled((environ.get('PREWARM_SESSIONS', "False")), False) # Open media sessions to every DC for each client at startup
+MEDIA_SESSION_IDLE = int(environ.get("MEDIA_SESSION_IDLE", "600")) # in Seconds, extra pooled media sessions unused this long are closed
+SESSION_KEEPALIVE = int(environ.get("SESSION_KEEPALIVE", "60")) # in Seconds, idle media sessions are pinged this often
 if 'DYNO' in environ:
     ON_HEROKU = True
 else:
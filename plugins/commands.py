@@ -17,6 +17,8 @@ import html  #added html for articals
 import base64
 from urllib.parse import quote_plus
 from Zahid.utils.file_properties import get_name, get_hash, get_media_file_size
+from Zahid.utils.signed_link import get_stream_links
+from Zahid.utils.file_store import file_store
 from pytz import timezone  # Import pytz to handle India Time (Asia/Kolkata)
 from datetime import date, datetime, timedelta
 import time
@@ -209,8 +211,8 @@ async def start(client, message):
                 if STREAM_MODE == True and (info.video or info.document or info.audio):
                     log_msg = info
                     fileName = quote_plus(get_name(log_msg))
-                    stream = f"{URL}watch/{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
-                    download = f"{URL}{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
+                    stream, download = get_stream_links(log_msg)
+                    file_store.remember(client, log_msg)
                     button = [[
                         InlineKeyboardButton("• ᴅᴏᴡɴʟᴏᴀᴅ •", url=download),
                         InlineKeyboardButton("• ᴡᴀᴛᴄʜ •", url=stream)
@@ -310,8 +312,8 @@ async def start(client, message):
                 if STREAM_MODE == True and (msg.video or msg.document or msg.audio):
                     log_msg = msg
                     fileName = quote_plus(get_name(log_msg))
-                    stream = f"{URL}watch/{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
-                    download = f"{URL}{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
+                    stream, download = get_stream_links(log_msg)
+                    file_store.remember(client, log_msg)
                     button = [[
                         InlineKeyboardButton("• 𝗗𝗼𝘄𝗻𝗹𝗼𝗮𝗱 •", url=download),
                         InlineKeyboardButton("• 𝗦𝘁𝗿𝗲𝗮𝗺 •", url=stream)
@@ -16,6 +16,7 @@ logger.setLevel(logging.INFO)
 
 
 COLLECTION_NAME = "Telegram_Files"
+STREAM_COLLECTION_NAME = "Stream_Files"
 
 
 
@@ -40,6 +41,54 @@ class Media(Document):
 
 
 
+@instance.register
+class StreamFile(Document):
+    key = fields.StrField(attribute='_id')
+    bot_id = fields.IntField(required=True)
+    message_id = fields.IntField(required=True)
+    file_id = fields.StrField(required=True)
+    file_size = fields.IntField(required=True)
+    mime_type = fields.StrField(allow_none=True)
+    file_name = fields.StrField(allow_none=True)
+    unique_id = fields.StrField(required=True)
+    date = fields.IntField(allow_none=True)
+    updated = fields.IntField(required=True)
+
+    class Meta:
+        indexes = (('bot_id', '-updated'), '-message_id')
+        collection_name = STREAM_COLLECTION_NAME
+
+
+
+async def save_stream_file(bot_id, message_id, **properties):
+    """Insert or replace the stream properties of a DB_CHANNEL message for one bot"""
+    stream_file = StreamFile(
+        key=f"{bot_id}:{message_id}",
+        bot_id=bot_id,
+        message_id=message_id,
+        **properties
+    )
+    await StreamFile.collection.replace_one(
+        {'_id': stream_file.key}, stream_file.to_mongo(), upsert=True
+    )
+
+
+
+async def get_stream_files(bot_id, limit):
+    """Return the most recently saved stream properties of a bot"""
+    cursor = StreamFile.find({'bot_id': bot_id}, sort=[('updated', -1)], limit=limit)
+    return await cursor.to_list(length=limit)
+
+
+
+async def get_latest_stream_message_id():
+    """Return the highest DB_CHANNEL message ID any bot has stored stream properties for"""
+    cursor = StreamFile.find({}, sort=[('message_id', -1)], limit=1)
+    latest = await cursor.to_list(length=1)
+    return latest[0].message_id if latest else None
+
+
+
 async def get_file_details(query):
     filter = {'file_id': query}
     cursor = Media.find(filter)
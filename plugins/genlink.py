@@ -3,6 +3,7 @@ from pyrogram import filters, Client, enums
 from pyrogram.errors.exceptions.bad_request_400 import ChannelInvalid, UsernameInvalid, UsernameNotModified
 from config import ADMINS, LOG_CHANNEL, DB_CHANNEL, PUBLIC_FILE_STORE, WEBSITE_URL, WEBSITE_URL_MODE
 from plugins.users_api import get_user, get_short_link
+from Zahid.utils.file_store import file_store
 import os
 import json
 import base64
@@ -22,6 +23,7 @@ async def incoming_gen_link(bot, message):
     username = (await bot.get_me()).username
     # Copy the message/file to your dedicated DB channel for permanent storage.
     post = await message.copy(DB_CHANNEL)
+    file_store.remember(bot, post)
     file_id = str(post.id)
     string = 'file_' + file_id
     outstr = base64.urlsafe_b64encode(string.encode("ascii")).decode().strip("=")
@@ -49,6 +51,7 @@ async def gen_link_s(bot, message):
      
     # Copy the replied message to the dedicated DB channel.
     post = await replied.copy(DB_CHANNEL)
+    file_store.remember(bot, post)
     file_id = str(post.id)
     string = f"file_{file_id}"
     outstr = base64.urlsafe_b64encode(string.encode("ascii")).decode().strip("=")